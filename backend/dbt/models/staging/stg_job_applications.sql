@@ -1,5 +1,7 @@
 {{ config(materialized='view') }}
 
+-- Pub/Sub redeliveries and Storage Write API retries can land the same email
+-- more than once (appends carry no insertId), so keep one row per email.
 select
   user_id,
   email_id,
@@ -9,4 +11,10 @@ select
   status,
   inserted_at,
   email_date
-from {{ source('user_data', 'job_applications') }}
+from (
+  select
+    *,
+    row_number() over (partition by user_id, email_id order by inserted_at desc) as row_num
+  from {{ source('user_data', 'job_applications') }}
+)
+where row_num = 1
@@ -0,0 +1,102 @@
+# gmail_fetch/gmail_batch.py
+#
+# Multipart encoder/decoder for Gmail's batch endpoint. A single POST to
+# BATCH_URL carries up to MAX_BATCH_SIZE `messages.get` sub-requests, and the
+# response comes back as one multipart/mixed body with an embedded HTTP
+# response per sub-request. Both helpers are pure functions over bytes so they
+# can be exercised offline against recorded responses.
+
+import json
+import re
+import uuid
+
+BATCH_URL      = "https://gmail.googleapis.com/batch/gmail/v1"
+MAX_BATCH_SIZE = 100
+
+_BOUNDARY_RE = re.compile(r'boundary="?([^";]+)"?', re.IGNORECASE)
+_CONTENT_ID_RE = re.compile(r"<(?:response-)?item-(\d+)>", re.IGNORECASE)
+
+
+def encode_batch_request(msg_ids, query="format=full", boundary=None):
+    """Build a multipart batch body for `messages.get` on each ID.
+
+    Returns (body_bytes, content_type). Sub-request N gets Content-ID
+    <item-N> so the response parts can be matched back to msg_ids[N].
+    """
+    if len(msg_ids) > MAX_BATCH_SIZE:
+        raise ValueError(f"Gmail batch requests are limited to {MAX_BATCH_SIZE} calls")
+
+    boundary = boundary or f"batch_{uuid.uuid4().hex}"
+    lines = []
+    for i, msg_id in enumerate(msg_ids):
+        path = f"/gmail/v1/users/me/messages/{msg_id}"
+        if query:
+            path = f"{path}?{query}"
+        lines += [
+            f"--{boundary}",
+            "Content-Type: application/http",
+            f"Content-ID: <item-{i}>",
+            "",
+            f"GET {path}",
+            "",
+        ]
+    lines.append(f"--{boundary}--")
+    body = "\r\n".join(lines).encode("utf-8")
+    return body, f"multipart/mixed; boundary={boundary}"
+
+
+def _split_headers(block):
+    """Split a header block + body on the first blank line."""
+    block = block.replace("\r\n", "\n")
+    head, _, body = block.partition("\n\n")
+    headers = {}
+    for line in head.split("\n"):
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    return head, headers, body
+
+
+def decode_batch_response(body, content_type, msg_ids):
+    """Parse a multipart batch response back into per-message results.
+
+    Returns {msg_id: (status_code, payload)} where payload is the decoded JSON
+    body (or None if it could not be parsed). IDs that have no matching part
+    are reported with status 0 so the caller can retry them.
+    """
+    match = _BOUNDARY_RE.search(content_type or "")
+    if not match:
+        raise ValueError(f"No boundary in batch response content type: {content_type!r}")
+    boundary = match.group(1)
+
+    if isinstance(body, bytes):
+        body = body.decode("utf-8")
+
+    results = {}
+    for part in body.split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == "--":
+            continue
+
+        _, outer_headers, inner = _split_headers(part)
+        cid = _CONTENT_ID_RE.search(outer_headers.get("content-id", ""))
+        if not cid:
+            continue
+        index = int(cid.group(1))
+        if index >= len(msg_ids):
+            continue
+
+        status_line, _, payload_text = _split_headers(inner)
+        try:
+            status = int(status_line.split("\n", 1)[0].split()[1])
+        except (IndexError, ValueError):
+            status = 0
+        try:
+            payload = json.loads(payload_text) if payload_text.strip() else None
+        except ValueError:
+            payload = None
+        results[msg_ids[index]] = (status, payload)
+
+    for msg_id in msg_ids:
+        results.setdefault(msg_id, (0, None))
+    return results
@@ -0,0 +1,119 @@
+# gmail_fetch/http_client.py
+#
+# Shared HTTP client for Gmail calls: one pooled keep-alive Session, retries
+# on 429/5xx and connection errors with exponential backoff + full jitter
+# (honoring Retry-After), and per-endpoint latency metrics.
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class LatencyMetrics:
+    """Thread-safe count / error / latency totals keyed by endpoint name."""
+
+    def __init__(self):
+        self._stats = {}
+        self._lock  = threading.Lock()
+
+    def record(self, endpoint, seconds, ok):
+        with self._lock:
+            s = self._stats.setdefault(endpoint, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            ms = seconds * 1000
+            s["count"]    += 1
+            s["errors"]   += 0 if ok else 1
+            s["total_ms"] += ms
+            s["max_ms"]    = max(s["max_ms"], ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                endpoint: {
+                    "count":  s["count"],
+                    "errors": s["errors"],
+                    "avg_ms": round(s["total_ms"] / s["count"], 1) if s["count"] else 0.0,
+                    "max_ms": round(s["max_ms"], 1),
+                }
+                for endpoint, s in self._stats.items()
+            }
+
+
+def retry_after_secs(resp):
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    value = resp.headers.get("Retry-After") if resp is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class GmailHttpClient:
+    """Pooled requests.Session with retry/backoff and latency metrics."""
+
+    def __init__(self, pool_size=32, max_retries=5, backoff_base=0.5, backoff_max=32.0, timeout=30):
+        self.max_retries  = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max  = backoff_max
+        self.timeout      = timeout
+        self.metrics      = LatencyMetrics()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _backoff(self, attempt, resp):
+        hinted = retry_after_secs(resp)
+        if hinted is not None:
+            return min(hinted, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def request(self, method, url, endpoint=None, **kwargs):
+        """Send a request, retrying 429/5xx and connection errors.
+
+        `endpoint` labels the call in the metrics (defaults to the URL path).
+        The final response is returned as-is; callers still decide whether to
+        raise_for_status().
+        """
+        endpoint = endpoint or url.split("?", 1)[0]
+        kwargs.setdefault("timeout", self.timeout)
+
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self.metrics.record(endpoint, time.perf_counter() - started, ok=False)
+                if attempt == self.max_retries:
+                    raise
+                wait = self._backoff(attempt, None)
+                print(f"🔁 {method} {endpoint} failed ({e}), retrying in {wait:.1f}s")
+                time.sleep(wait)
+                continue
+
+            ok = resp.status_code not in RETRYABLE_STATUSES
+            self.metrics.record(endpoint, time.perf_counter() - started, ok=ok)
+            if ok or attempt == self.max_retries:
+                return resp
+
+            wait = self._backoff(attempt, resp)
+            print(f"🔁 {method} {endpoint} returned {resp.status_code}, retrying in {wait:.1f}s")
+            time.sleep(wait)
+
+    def get(self, url, endpoint=None, **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint=None, **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
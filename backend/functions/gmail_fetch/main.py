@@ -3,13 +3,25 @@
 import os
 import json
 import time
+import base64
+from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from google.cloud import firestore
 from google.cloud.pubsub_v1 import PublisherClient
+from google.cloud.pubsub_v1.types import BatchSettings
 from google.oauth2.credentials import Credentials
 import google.auth.transport.requests
 import requests
+
+from rate_limiter import TokenBucket
+from http_client import GmailHttpClient, RETRYABLE_STATUSES
+from gmail_batch import BATCH_URL, MAX_BATCH_SIZE, encode_batch_request, decode_batch_response
+from scheduler import run_user_syncs
+from token_cache import TokenCache
+from sharding import InMemoryWorkQueue, PubSubWorkQueue, build_work_items
+from projection import PROJECTIONS, ProjectionStats, email_content, extract_headers, message_query
 # from firebase_admin import auth, initialize_app, credentials
 
 app = Flask(__name__)
@@ -27,10 +39,67 @@ print("🚀 Starting gmail-fetch app…")
 PROJECT_ID            = "onlyjobs-465420"
 FIRESTORE_COLLECTION  = "gmail_auth"
 PUBSUB_TOPIC          = f"projects/{PROJECT_ID}/topics/new-emails-topic"
+GMAIL_API_BASE        = "https://gmail.googleapis.com/gmail/v1/users/me"
+
+# Concurrent detail fetching: worker threads per user sync, and a token bucket
+# (requests/sec) shared by those workers to stay under the Gmail per-user quota.
+FETCH_CONCURRENCY     = int(os.environ.get("FETCH_CONCURRENCY", "8"))
+GMAIL_MAX_RPS         = float(os.environ.get("GMAIL_MAX_RPS", "40"))
+
+# "batch" packs up to GMAIL_BATCH_SIZE messages.get calls into one multipart
+# request; "concurrent" issues one GET per message from the thread pool.
+FETCH_MODE            = os.environ.get("FETCH_MODE", "batch").lower()
+GMAIL_BATCH_SIZE      = min(int(os.environ.get("GMAIL_BATCH_SIZE", "50")), MAX_BATCH_SIZE)
+BATCH_MAX_RETRIES     = int(os.environ.get("BATCH_MAX_RETRIES", "3"))
+
+# Which message fields to request: "metadata" (snippet + headers) by default,
+# "full" only when the classifier needs body text. See projection.py.
+FETCH_PROJECTION      = os.environ.get("FETCH_PROJECTION", "metadata").lower()
+
+# Pub/Sub client-side batching: a batch is sent when any threshold is hit.
+PUBLISH_MAX_MESSAGES  = int(os.environ.get("PUBLISH_MAX_MESSAGES", "100"))
+PUBLISH_MAX_BYTES     = int(os.environ.get("PUBLISH_MAX_BYTES", str(1024 * 1024)))
+PUBLISH_MAX_LATENCY   = float(os.environ.get("PUBLISH_MAX_LATENCY", "0.05"))
+PUBLISH_TIMEOUT       = float(os.environ.get("PUBLISH_TIMEOUT", "60"))
+
+# /fetch scheduling: users synced in parallel, per-user budget, and an overall
+# budget that keeps a run inside the Cloud Run request timeout.
+SYNC_USER_CONCURRENCY = int(os.environ.get("SYNC_USER_CONCURRENCY", "4"))
+SYNC_USER_BUDGET_SECS = float(os.environ.get("SYNC_USER_BUDGET_SECS", "300"))
+SYNC_TOTAL_BUDGET_SECS = float(os.environ.get("SYNC_TOTAL_BUDGET_SECS", "1800"))
+# History additions are fetched and published in pages of this many IDs; the
+# budget is checked before each page.
+HISTORY_PAGE_SIZE     = max(1, int(os.environ.get("HISTORY_PAGE_SIZE", "100")))
+
+# Sharded fan-out: /fetch/coordinate puts one work item per shard on the work
+# queue ("pubsub" -> FETCH_SHARDS_TOPIC pushed to /fetch/shard, or "memory"
+# to run every shard in-process for local testing).
+WORK_QUEUE            = os.environ.get("WORK_QUEUE", "pubsub").lower()
+FETCH_SHARDS_TOPIC    = f"projects/{PROJECT_ID}/topics/{os.environ.get('FETCH_SHARDS_TOPIC', 'fetch-shards-topic')}"
+DEFAULT_SHARDS        = int(os.environ.get("FETCH_SHARDS", "4"))
+# A shard is synced inside its push request, so it must finish before the
+# subscription's ack deadline (600s at most) or Pub/Sub redelivers it and the
+# shard runs twice. The budget is cooperative (the page in progress and its
+# publish wait still finish), so keep it well below the subscription's deadline.
+SHARD_BUDGET_SECS     = float(os.environ.get("SHARD_BUDGET_SECS", "480"))
+
+# Access tokens are reused until TOKEN_REFRESH_SKEW_SECS before they expire.
+TOKEN_CACHE_SIZE      = int(os.environ.get("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_REFRESH_SKEW_SECS = int(os.environ.get("TOKEN_REFRESH_SKEW_SECS", "300"))
+
+# Shared Gmail HTTP client: keep-alive pool size and retry policy for 429/5xx.
+HTTP_POOL_SIZE        = int(os.environ.get("HTTP_POOL_SIZE", "32"))
+HTTP_MAX_RETRIES      = int(os.environ.get("HTTP_MAX_RETRIES", "5"))
 
 # === Initialize Clients ===
 firestore_client = firestore.Client(project=PROJECT_ID)
-publisher        = PublisherClient()
+publisher        = PublisherClient(batch_settings=BatchSettings(
+    max_messages=PUBLISH_MAX_MESSAGES,
+    max_bytes=PUBLISH_MAX_BYTES,
+    max_latency=PUBLISH_MAX_LATENCY,
+))
+gmail_http       = GmailHttpClient(pool_size=HTTP_POOL_SIZE, max_retries=HTTP_MAX_RETRIES)
+work_queue       = InMemoryWorkQueue() if WORK_QUEUE == "memory" else PubSubWorkQueue(publisher, FETCH_SHARDS_TOPIC)
 
 # === Authentication Helper ===
 def verify_firebase_token():
@@ -47,10 +116,8 @@ def verify_firebase_token():
         return None, f"Invalid token: {str(e)}"
 
 
-def fetch_emails_for_user(uid, creds_dict, backfill=False, max_emails=500):
-    print(f"📩 Fetching emails for user: {uid}")
-
-    # build Credentials and refresh to get a valid access token
+def refresh_access_token(creds_dict):
+    """Build Credentials and refresh them; returns (token, expiry_epoch_secs)."""
     creds = Credentials(
         token=creds_dict.get("token"),
         refresh_token=creds_dict.get("refresh_token"),
@@ -60,17 +127,211 @@ def fetch_emails_for_user(uid, creds_dict, backfill=False, max_emails=500):
         scopes=creds_dict.get("scopes", []),
     )
     creds.refresh(google.auth.transport.requests.Request())
+    # google-auth reports expiry as a naive UTC datetime
+    expiry = creds.expiry.replace(tzinfo=timezone.utc).timestamp() if creds.expiry else None
+    return creds.token, expiry
 
-    headers = {"Authorization": f"Bearer {creds.token}"}
-    list_url = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
 
-    # figure out how far we’ve already fetched
-    last_fetched_ms = creds_dict.get("last_fetched", 0)
-    after_secs      = int(last_fetched_ms / 1000)
+def persist_access_token(uid, token, expiry):
+    """Write a refreshed token back to gmail_auth so other runs can reuse it."""
+    firestore_client.collection(FIRESTORE_COLLECTION).document(uid).update({
+        "token":        token,
+        "token_expiry": expiry,
+    })
+
 
-    fetched = 0
-    next_page_token = None
+token_cache = TokenCache(
+    refresh_access_token,
+    persist_access_token,
+    max_entries=TOKEN_CACHE_SIZE,
+    skew_secs=TOKEN_REFRESH_SKEW_SECS,
+)
+
+
+def fetch_message_detail(msg_id, headers, limiter, projection, stats):
+    """Fetch a single message's details, waiting on the rate limiter first.
+
+    Returns None when the message no longer exists (history.list still
+    reports messages deleted since they were added).
+    """
+    limiter.acquire()
+    detail_url = f"{GMAIL_API_BASE}/messages/{msg_id}?{message_query(projection)}"
+    dresp = gmail_http.get(detail_url, endpoint="messages.get", headers=headers)
+    if dresp.status_code == 404:
+        print(f"⚠️ Message {msg_id} no longer exists, skipping")
+        return None
+    dresp.raise_for_status()
+    started = time.perf_counter()
+    payload = dresp.json()
+    stats.record(len(dresp.content), parse_secs=time.perf_counter() - started)
+    return payload
+
+
+def fetch_message_details_batch(msg_ids, headers, limiter, projection, stats):
+    """Fetch message details through the Gmail batch endpoint.
+
+    Sub-requests that fail with a retryable status (or are missing from the
+    response) are re-sent on their own in a smaller batch; 404s (message
+    deleted since listing) are dropped and other 4xx are given up on at once.
+    A 401 part raises requests.HTTPError like a 401 on the batch itself, so
+    fetch_emails_for_user refreshes the token and retries. Returns ({msg_id: payload} for every message that was fetched, [msg_id]
+    still failing after BATCH_MAX_RETRIES) so the caller can hold its cursor.
+    """
+    results     = {}
+    pending     = list(msg_ids)
+    given_up    = []
+    round_trips = 0
+
+    for attempt in range(BATCH_MAX_RETRIES + 1):
+        if not pending:
+            break
+        if attempt:
+            time.sleep(min(2 ** attempt, 10))
+
+        failed = []
+        for i in range(0, len(pending), GMAIL_BATCH_SIZE):
+            chunk = pending[i:i + GMAIL_BATCH_SIZE]
+            limiter.acquire(len(chunk))
+            body, content_type = encode_batch_request(chunk, query=message_query(projection))
+            resp = gmail_http.post(
+                BATCH_URL,
+                endpoint="batch",
+                headers={**headers, "Content-Type": content_type},
+                data=body,
+            )
+            resp.raise_for_status()
+            round_trips += 1
+
+            started = time.perf_counter()
+            parts = decode_batch_response(resp.content, resp.headers.get("Content-Type"), chunk)
+            stats.record(len(resp.content), len(chunk), time.perf_counter() - started)
+            for msg_id, (status, payload) in parts.items():
+                if status == 200 and payload is not None:
+                    results[msg_id] = payload
+                elif status == 404:
+                    print(f"⚠️ Message {msg_id} no longer exists, skipping")
+                elif status == 401:
+                    unauthorized = requests.Response()
+                    unauthorized.status_code = 401
+                    unauthorized.url = BATCH_URL
+                    raise requests.HTTPError(f"401 for message {msg_id} in batch", response=unauthorized)
+                elif status == 0 or status in RETRYABLE_STATUSES:
+                    failed.append(msg_id)
+                else:
+                    print(f"❌ Message {msg_id} failed with HTTP {status}, not retrying")
+                    given_up.append(msg_id)
+        pending = failed
+
+    if pending:
+        print(f"❌ Giving up on {len(pending)} message(s) after {BATCH_MAX_RETRIES} retries: {pending}")
+    print(f"📦 Batch fetched {len(results)} message(s) in {round_trips} round trip(s)")
+    return results, given_up + pending
+
+
+def fetch_message_details(msg_ids, headers, limiter, workers, projection, stats):
+    """Fetch details for msg_ids using FETCH_MODE.
+
+    Returns ([(msg_id, payload)] in order, [msg_id] that could not be fetched).
+    """
+    if FETCH_MODE == "batch":
+        details, failed = fetch_message_details_batch(msg_ids, headers, limiter, projection, stats)
+        return [(msg_id, details[msg_id]) for msg_id in msg_ids if msg_id in details], failed
+
+    def fetch_one(msg_id):
+        try:
+            return fetch_message_detail(msg_id, headers, limiter, projection, stats)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 401:
+                raise   # fetch_emails_for_user refreshes the token and retries
+            print(f"❌ Failed to fetch message {msg_id}: {e}")
+            return e
+        except Exception as e:
+            # reported back instead of raised, so one bad message doesn't abort the rest
+            print(f"❌ Failed to fetch message {msg_id}: {e}")
+            return e
+
+    # pull details concurrently; map() keeps Gmail's ordering for publishing
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        payloads = list(pool.map(fetch_one, msg_ids))
+    fetched = [(msg_id, p) for msg_id, p in zip(msg_ids, payloads) if p is not None and not isinstance(p, Exception)]
+    failed  = [msg_id for msg_id, p in zip(msg_ids, payloads) if isinstance(p, Exception)]
+    return fetched, failed
+
+
+class HistoryExpired(Exception):
+    """The stored historyId is too old for users.history.list (HTTP 404)."""
+
+
+def get_mailbox_history_id(headers):
+    """Current historyId of the mailbox, used to seed the sync cursor."""
+    resp = gmail_http.get(f"{GMAIL_API_BASE}/profile", endpoint="getProfile", headers=headers)
+    resp.raise_for_status()
+    return resp.json()["historyId"]
+
+
+def list_history_additions(headers, start_history_id):
+    """Messages added to INBOX since start_history_id.
+
+    Returns ([(record_history_id, msg_id), ...], latest_history_id) in history
+    order with duplicate message IDs removed. Raises HistoryExpired when Gmail
+    no longer has history that far back.
+    """
+    additions = []
+    seen = set()
+    page_token = None
+    latest = start_history_id
+
+    while True:
+        params = {
+            "startHistoryId": start_history_id,
+            "historyTypes":   "messageAdded",
+            "labelId":        "INBOX",
+            "maxResults":     500,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+
+        resp = gmail_http.get(f"{GMAIL_API_BASE}/history", endpoint="history.list", headers=headers, params=params)
+        if resp.status_code == 404:
+            raise HistoryExpired(start_history_id)
+        resp.raise_for_status()
+        data = resp.json()
 
+        for record in data.get("history", []):
+            for added in record.get("messagesAdded", []):
+                msg_id = added["message"]["id"]
+                if msg_id not in seen:
+                    seen.add(msg_id)
+                    additions.append((record["id"], msg_id))
+
+        latest = data.get("historyId", latest)
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            return additions, latest
+
+
+def resume_history_id(additions, pending_ids, start_history_id, latest_history_id):
+    """History cursor to persist once additions have been published.
+
+    latest_history_id if nothing is pending; otherwise the last record before
+    the first pending message, so the next run starts with that record again
+    (a record can add several messages, so it is never split).
+    """
+    for i, (record_id, msg_id) in enumerate(additions):
+        if msg_id in pending_ids:
+            done = [rid for rid, _ in additions[:i] if rid != record_id]
+            return done[-1] if done else start_history_id
+    return latest_history_id
+
+
+def iter_list_pages(headers, backfill, after_secs, page_token=None):
+    """Full list scan of INBOX message IDs.
+
+    Yields (msg_ids, next_page_token) per page, starting from page_token.
+    Incremental scans only look at the first page of messages after
+    after_secs; backfills walk every page.
+    """
+    next_page_token = page_token
     while True:
         params = {
             "maxResults": 100 if backfill else 10,
@@ -83,7 +344,7 @@ def fetch_emails_for_user(uid, creds_dict, backfill=False, max_emails=500):
         if next_page_token:
             params["pageToken"] = next_page_token
 
-        resp = requests.get(list_url, headers=headers, params=params)
+        resp = gmail_http.get(f"{GMAIL_API_BASE}/messages", endpoint="messages.list", headers=headers, params=params)
         resp.raise_for_status()
         data = resp.json()
 
@@ -91,51 +352,273 @@ def fetch_emails_for_user(uid, creds_dict, backfill=False, max_emails=500):
         next_page_token = data.get("nextPageToken")
         print(f"📬 Retrieved {len(msgs)} messages")
 
-        if not msgs:
+        if msgs:
+            yield [m["id"] for m in msgs], next_page_token
+        if not msgs or not backfill or not next_page_token:
+            return
+
+
+def publish_messages(uid, msg_ids, headers, limiter, workers, projection, stats):
+    """Fetch details for msg_ids and queue one Pub/Sub publish each.
+
+    Returns (publish futures, [msg_id] whose details could not be fetched).
+    """
+    futures = []
+    details, fetch_failed = fetch_message_details(msg_ids, headers, limiter, workers, projection, stats)
+    for msg_id, payload in details:
+        email_date = int(payload.get("internalDate", 0))
+        mail_hdrs  = extract_headers(payload)
+
+        pubsub_data = json.dumps({
+            "user_id":       uid,
+            "email_id":      msg_id,
+            "email_content": email_content(payload, projection),
+            "email_date":    email_date,
+            "from":          mail_hdrs.get("From", ""),
+            "subject":       mail_hdrs.get("Subject", ""),
+            "headers":       mail_hdrs,
+        }).encode("utf-8")
+
+        futures.append((msg_id, publisher.publish(PUBSUB_TOPIC, data=pubsub_data)))
+    return futures, fetch_failed
+
+
+def wait_for_publishes(uid, futures):
+    """Block once on every pending publish; returns (published, failed_ids)."""
+    published, failed = 0, []
+    for msg_id, future in futures:
+        try:
+            future.result(timeout=PUBLISH_TIMEOUT)
+            published += 1
+        except Exception as e:
+            print(f"❌ Failed to publish email {msg_id} for {uid}: {e}")
+            failed.append(msg_id)
+    print(f"✅ Published {published} email(s) for {uid}, {len(failed)} failed")
+    return published, failed
+
+
+def sync_incremental(uid, creds_dict, headers, limiter, workers, projection, stats, max_emails, deadline):
+    """Publish messages that arrived since the last run and advance the cursors."""
+    # Prefer the history API when we have a cursor: it returns exactly the
+    # messages added since the last run. First runs and expired cursors fall
+    # back to a list scan, seeded with the current historyId (taken *before*
+    # scanning so nothing that arrives mid-scan is missed).
+    history_id = creds_dict.get("history_id")
+    additions  = None
+    if history_id:
+        try:
+            additions, latest_history_id = list_history_additions(headers, history_id)
+            print(f"🕰️ History since {history_id}: {len(additions)} new message(s)")
+        except HistoryExpired:
+            print(f"⚠️ historyId {history_id} expired for {uid}, falling back to list scan")
+
+    if additions is not None:
+        # pages, so the time budget is checked between chunks of a large history
+        msg_ids = [msg_id for _, msg_id in additions[:max_emails]]
+        pages   = [msg_ids[i:i + HISTORY_PAGE_SIZE] for i in range(0, len(msg_ids), HISTORY_PAGE_SIZE)]
+    else:
+        latest_history_id = get_mailbox_history_id(headers)
+        after_secs        = int(creds_dict.get("last_fetched", 0) / 1000)
+        pages             = (msg_ids for msg_ids, _ in iter_list_pages(headers, False, after_secs))
+
+    # publishes are batched by the client; futures are only awaited at the end
+    # so detail fetching for the next page overlaps with publishing this one
+    futures, fetch_failed, attempted, complete = [], [], set(), True
+    for msg_ids in pages:
+        if deadline and time.monotonic() >= deadline:
+            print(f"⏳ Time budget exhausted for {uid}, stopping after {len(futures)} email(s)")
+            complete = False
+            break
+        capped = msg_ids[:max_emails - len(futures)]
+        complete = complete and len(capped) == len(msg_ids)
+        attempted.update(capped)
+        page_futures, page_failed = publish_messages(uid, capped, headers, limiter, workers, projection, stats)
+        futures      += page_futures
+        fetch_failed += page_failed
+        if len(futures) >= max_emails:
             break
 
-        for m in msgs:
-            msg_id = m["id"]
-            detail_url = f"https://gmail.googleapis.com/gmail/v1/users/me/messages/{msg_id}?format=full"
-            dresp = requests.get(detail_url, headers=headers)
-            dresp.raise_for_status()
-            payload = dresp.json()
+    fetched, failed = wait_for_publishes(uid, futures)
+    failed += fetch_failed
+
+    # persist the cursors so the next run only gets newer messages, but never
+    # past a message that was not published: the next run must pick it up
+    doc_ref = firestore_client.collection(FIRESTORE_COLLECTION).document(uid)
+    if additions is not None:
+        pending = set(failed) | {msg_id for _, msg_id in additions if msg_id not in attempted}
+        cursor  = resume_history_id(additions, pending, history_id, latest_history_id)
+        update  = {"history_id": cursor}
+        if not pending:
+            update["last_fetched"] = int(time.time() * 1000)
+        doc_ref.update(update)
+        print(f"🔄 Updated history_id={cursor} for {uid}, {len(pending)} message(s) left for the next run")
+    elif complete and not failed:
+        doc_ref.update({
+            "last_fetched": int(time.time() * 1000),
+            "history_id":   latest_history_id,
+        })
+        print(f"🔄 Updated last_fetched and history_id={latest_history_id} for {uid}")
+    else:
+        print(f"⚠️ Not all new messages were published for {uid}; cursors left unchanged for a retry")
+    return fetched
 
-            email_date = int(payload.get("internalDate", 0))
-            snippet    = payload.get("snippet", "")
 
-            pubsub_data = json.dumps({
-                "user_id":       uid,
-                "email_id":      msg_id,
-                "email_content": snippet,
-                "email_date":    email_date,
-            }).encode("utf-8")
+def run_backfill(uid, creds_dict, headers, limiter, workers, projection, stats, max_emails, deadline):
+    """Walk the whole INBOX, checkpointing after every page so it can resume.
 
-            publisher.publish(PUBSUB_TOPIC, data=pubsub_data).result()
-            print(f"✅ Published email {msg_id}")
+    The checkpoint (next page token, processed count, status) lives in the
+    gmail_auth doc under "backfill_checkpoint". A "running" checkpoint is
+    picked up by the next backfill invocation; each invocation stops at
+    max_emails or its deadline and leaves the rest for the next one. A page
+    with messages that failed to fetch or publish is not checkpointed past:
+    the invocation stops and the next one re-runs that page.
+    """
+    doc_ref    = firestore_client.collection(FIRESTORE_COLLECTION).document(uid)
+    checkpoint = creds_dict.get("backfill_checkpoint") or {}
+    now_ms     = int(time.time() * 1000)
 
-            fetched += 1
-            time.sleep(0.1)
-            if not backfill and fetched >= max_emails:
-                break
+    if checkpoint.get("status") == "running":
+        print(f"⏯️ Resuming backfill for {uid} after {checkpoint['processed']} email(s)")
+    else:
+        checkpoint = {
+            "status":     "running",
+            "page_token": None,
+            "pages":      0,
+            "processed":  0,
+            "failed":     0,
+            # cursor for incremental syncs once this backfill completes
+            "history_id": get_mailbox_history_id(headers),
+            "started_at": now_ms,
+            "updated_at": now_ms,
+        }
+        doc_ref.update({"backfill_checkpoint": checkpoint})
 
-        if not backfill or not next_page_token or fetched >= max_emails:
+    fetched = 0
+    for msg_ids, next_page_token in iter_list_pages(headers, True, 0, checkpoint["page_token"]):
+        # wait for this page's publishes before checkpointing past it
+        futures, fetch_failed = publish_messages(uid, msg_ids, headers, limiter, workers, projection, stats)
+        published, failed = wait_for_publishes(uid, futures)
+        failed  += fetch_failed
+        fetched += published
+
+        if failed:
+            checkpoint.update({
+                "failed":     checkpoint["failed"] + len(failed),
+                "updated_at": int(time.time() * 1000),
+            })
+            doc_ref.update({"backfill_checkpoint": checkpoint})
+            print(f"⏸️ {len(failed)} message(s) failed to fetch or publish on page {checkpoint['pages'] + 1} for {uid}; "
+                  f"the next backfill run retries this page")
+            return fetched
+
+        checkpoint.update({
+            "page_token": next_page_token,
+            "pages":      checkpoint["pages"] + 1,
+            "processed":  checkpoint["processed"] + published,
+            "updated_at": int(time.time() * 1000),
+        })
+        if not next_page_token:
             break
-
-    # update last_fetched so next run only gets newer messages
-    firestore_client.collection(FIRESTORE_COLLECTION).document(uid).update({
-        "last_fetched": int(time.time() * 1000)
+        doc_ref.update({"backfill_checkpoint": checkpoint})
+        print(f"💾 Backfill checkpoint for {uid}: page {checkpoint['pages']}, {checkpoint['processed']} email(s)")
+
+        if fetched >= max_emails or (deadline and time.monotonic() >= deadline):
+            print(f"⏸️ Pausing backfill for {uid}; the next backfill run resumes from here")
+            return fetched
+
+    checkpoint.update({"status": "complete", "page_token": None, "updated_at": int(time.time() * 1000)})
+    doc_ref.update({
+        "backfill_checkpoint": checkpoint,
+        "last_fetched":        int(time.time() * 1000),
+        # don't rewind a cursor that incremental syncs advanced meanwhile
+        "history_id":          creds_dict.get("history_id") or checkpoint["history_id"],
     })
-    print(f"🔄 Updated last_fetched for {uid}")
+    print(f"🏁 Backfill complete for {uid}: {checkpoint['processed']} email(s) in {checkpoint['pages']} page(s)")
+    return fetched
+
+
+def fetch_emails_for_user(uid, creds_dict, backfill=False, max_emails=500, concurrency=None,
+                          projection=None, deadline=None):
+    print(f"📩 Fetching emails for user: {uid}")
+
+    headers = {"Authorization": f"Bearer {token_cache.get_token(uid, creds_dict)}"}
+    limiter  = TokenBucket(GMAIL_MAX_RPS)
+    workers  = max(1, concurrency or FETCH_CONCURRENCY)
+    projection = projection or FETCH_PROJECTION
+    stats      = ProjectionStats(projection)
+
+    cpu_start = time.process_time()
+    sync = run_backfill if backfill else sync_incremental
+    try:
+        fetched = sync(uid, creds_dict, headers, limiter, workers, projection, stats, max_emails, deadline)
+    except requests.HTTPError as e:
+        if e.response is None or e.response.status_code != 401:
+            raise
+        # revoked or otherwise dead token: drop it, refresh from the grant and retry once
+        print(f"🔑 Gmail rejected the access token for {uid}, refreshing and retrying")
+        token_cache.invalidate(uid)
+        headers["Authorization"] = f"Bearer {token_cache.get_token(uid, creds_dict, force_refresh=True)}"
+        fetched = sync(uid, creds_dict, headers, limiter, workers, projection, stats, max_emails, deadline)
+
+    if fetched:
+        cpu_ms = (time.process_time() - cpu_start) * 1000 / fetched
+        print(f"⏱️ {cpu_ms:.2f} ms CPU per published email for {uid}")
+    print(f"📏 Projection report for {uid}: {stats.summary()}")
+    print(f"📈 Gmail latency so far: {gmail_http.metrics.snapshot()}")
 
     return fetched
 
 
+def load_users(docs):
+    """(uid, creds) pairs for the docs that exist and hold a token."""
+    users = []
+    for doc in docs:
+        if not doc.exists:
+            print(f"⚠️ No creds found for UID={doc.id}")
+            continue
+
+        creds = doc.to_dict()
+        if "token" not in creds:
+            print(f"⚠️ Skipping {doc.id} — no token field")
+            continue
+        users.append((doc.id, creds))
+    return users
+
+
+def sync_users(users, backfill, projection, total_budget_secs=SYNC_TOTAL_BUDGET_SECS):
+    return run_user_syncs(
+        users,
+        lambda uid, creds, deadline: fetch_emails_for_user(
+            uid, creds, backfill=backfill, projection=projection, deadline=deadline
+        ),
+        max_concurrency=SYNC_USER_CONCURRENCY,
+        user_budget_secs=SYNC_USER_BUDGET_SECS,
+        total_budget_secs=total_budget_secs,
+    )
+
+
+def sync_shard(item):
+    """Sync every user listed in a shard work item."""
+    print(f"🧩 Syncing shard {item['shard']}/{item['num_shards']} of run {item['run_id']}")
+    collection = firestore_client.collection(FIRESTORE_COLLECTION)
+    docs = firestore_client.get_all([collection.document(uid) for uid in item["uids"]])
+    results = sync_users(load_users(docs), item.get("backfill", False),
+                         item.get("projection", FETCH_PROJECTION), total_budget_secs=SHARD_BUDGET_SECS)
+    return {
+        "run_id":  item["run_id"],
+        "shard":   item["shard"],
+        "results": results,
+    }
+
+
 @app.route("/fetch", methods=["POST"])
 def fetch_all():
     print("📥 Received /fetch POST request")
     backfill = request.args.get("backfill", "false").lower() == "true"
     explicit_uid = request.args.get("uid")
+    projection = request.args.get("projection", FETCH_PROJECTION).lower()
+    if projection not in PROJECTIONS:
+        return jsonify({"error": f"Unknown projection: {projection}"}), 400
 
     # choose which user docs to process
     if explicit_uid:
@@ -143,32 +626,119 @@ def fetch_all():
     else:
         docs = firestore_client.collection(FIRESTORE_COLLECTION).stream()
 
-    processed_users = 0
-    for doc in docs:
-        if not doc.exists:
-            print(f"⚠️ No creds found for UID={doc.id}")
-            continue
-
-        creds = doc.to_dict()
-        if "token" not in creds:
-            print(f"⚠️ Skipping {doc.id} — no token field")
-            continue
-
-        try:
-            fetched = fetch_emails_for_user(doc.id, creds, backfill=backfill)
-            if fetched:
-                processed_users += 1
-        except Exception as e:
-            print(f"❌ Error for {doc.id}: {e}")
+    results = sync_users(load_users(docs), backfill, projection)
+    processed_users = sum(1 for r in results if r["fetched"])
 
     print(f"✅ Done. Processed {processed_users} user(s).")
     return jsonify({
         "status":          "complete",
         "users_processed": processed_users,
-        "backfill":        backfill
+        "backfill":        backfill,
+        "results":         results,
     })
 
 
+@app.route("/fetch/coordinate", methods=["POST"])
+def fetch_coordinate():
+    """Partition all users into shards and enqueue one work item per shard."""
+    print("📥 Received /fetch/coordinate POST request")
+    backfill   = request.args.get("backfill", "false").lower() == "true"
+    projection = request.args.get("projection", FETCH_PROJECTION).lower()
+    num_shards = max(1, int(request.args.get("shards", DEFAULT_SHARDS)))
+    if projection not in PROJECTIONS:
+        return jsonify({"error": f"Unknown projection: {projection}"}), 400
+
+    # IDs only — workers load each shard's credentials themselves
+    uids  = [doc.id for doc in firestore_client.collection(FIRESTORE_COLLECTION).select([]).stream()]
+    items = build_work_items(uids, num_shards, backfill=backfill, projection=projection)
+    for item in items:
+        work_queue.publish(item)
+    print(f"🧩 Enqueued {len(items)} shard(s) for {len(uids)} user(s)")
+
+    response = {
+        "status":     "enqueued",
+        "run_id":     items[0]["run_id"] if items else None,
+        "num_shards": num_shards,
+        "shards":     [{"shard": i["shard"], "users": len(i["uids"])} for i in items],
+    }
+    if isinstance(work_queue, InMemoryWorkQueue):
+        response["status"]  = "complete"
+        response["results"] = work_queue.drain(sync_shard)
+    return jsonify(response)
+
+
+@app.route("/fetch/shard", methods=["POST"])
+def fetch_shard():
+    """Pub/Sub push handler: sync the users of one shard work item."""
+    envelope = request.get_json(silent=True)
+    if not envelope or "data" not in envelope.get("message", {}):
+        print("❌ Invalid Pub/Sub message on /fetch/shard")
+        return "Invalid Pub/Sub message", 400
+
+    try:
+        item = json.loads(base64.b64decode(envelope["message"]["data"]).decode("utf-8"))
+    except Exception as e:
+        print(f"❌ Invalid shard work item: {e}")
+        return "Invalid work item", 400
+
+    return jsonify(sync_shard(item))
+
+
+@app.route("/projection-report", methods=["GET"])
+def projection_report():
+    """Fetch the same sample of messages under every projection and compare sizes."""
+    uid = request.args.get("uid")
+    sample = min(int(request.args.get("sample", "20")), 100)
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+
+    doc = firestore_client.collection(FIRESTORE_COLLECTION).document(uid).get()
+    if not doc.exists:
+        return jsonify({"error": f"No creds found for UID={uid}"}), 404
+
+    headers = {"Authorization": f"Bearer {token_cache.get_token(uid, doc.to_dict())}"}
+    resp = gmail_http.get(f"{GMAIL_API_BASE}/messages", endpoint="messages.list", headers=headers,
+                    params={"maxResults": sample, "labelIds": ["INBOX"]})
+    resp.raise_for_status()
+    msg_ids = [m["id"] for m in resp.json().get("messages", [])]
+
+    limiter = TokenBucket(GMAIL_MAX_RPS)
+    report = {}
+    for name in PROJECTIONS:
+        stats = ProjectionStats(name)
+        for msg_id in msg_ids:
+            fetch_message_detail(msg_id, headers, limiter, name, stats)
+        report[name] = stats.summary()
+
+    full_bytes = report["full"]["bytes"] or 1
+    report["metadata_bytes_saved_pct"] = round(100 * (1 - report["metadata"]["bytes"] / full_bytes), 1)
+    print(f"📏 Projection report for {uid}: {report}")
+    return jsonify(report)
+
+
+@app.route("/backfill/status", methods=["GET"])
+def backfill_status():
+    """Progress of the most recent (or currently running) backfill for a user."""
+    uid = request.args.get("uid")
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+
+    doc = firestore_client.collection(FIRESTORE_COLLECTION).document(uid).get()
+    if not doc.exists:
+        return jsonify({"error": f"No creds found for UID={uid}"}), 404
+
+    checkpoint = doc.to_dict().get("backfill_checkpoint")
+    if not checkpoint:
+        return jsonify({"uid": uid, "status": "none"})
+    return jsonify({"uid": uid, **checkpoint})
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Per-endpoint Gmail call counts, errors and latency for this instance."""
+    return jsonify(gmail_http.metrics.snapshot())
+
+
 @app.route("/health", methods=["GET"])
 def health():
     return "OK", 200
@@ -0,0 +1,88 @@
+# gmail_fetch/projection.py
+#
+# Field projections for messages.get. The classifier only needs the snippet,
+# date and a few headers, so the default "metadata" projection asks Gmail for
+# exactly that; "full" (MIME bodies) is opt-in for when body text is needed.
+
+import base64
+import threading
+from urllib.parse import urlencode
+
+# From/Subject feed the process_emails prefilter; List-Unsubscribe and
+# Precedence mark bulk mail it can reject without a Gemini call.
+CLASSIFIER_HEADERS = ["From", "Subject", "Date", "List-Unsubscribe", "Precedence"]
+
+PROJECTIONS = {
+    "metadata": {
+        "format":          "metadata",
+        "metadataHeaders": CLASSIFIER_HEADERS,
+        "fields":          "id,internalDate,snippet,payload/headers",
+    },
+    "full": {
+        "format": "full",
+        "fields": "id,internalDate,snippet,payload(mimeType,headers,body/data,parts)",
+    },
+}
+
+
+def message_query(projection):
+    """Query string for messages.get under the given projection name."""
+    if projection not in PROJECTIONS:
+        raise ValueError(f"Unknown projection {projection!r}; expected one of {sorted(PROJECTIONS)}")
+    return urlencode(PROJECTIONS[projection], doseq=True)
+
+
+def extract_headers(payload):
+    """Map the projected headers (From, Subject, ...) to their values."""
+    headers = payload.get("payload", {}).get("headers", [])
+    return {h.get("name", ""): h.get("value", "") for h in headers}
+
+
+def extract_body_text(payload):
+    """Concatenate the decoded text/plain parts of a format=full message."""
+    texts = []
+    stack = [payload.get("payload", {})]
+    while stack:
+        part = stack.pop(0)
+        stack.extend(part.get("parts", []))
+        data = part.get("body", {}).get("data")
+        if data and part.get("mimeType", "").startswith("text/plain"):
+            raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+            texts.append(raw.decode("utf-8", errors="replace"))
+    return "\n".join(texts)
+
+
+def email_content(payload, projection):
+    """Text handed to the classifier: body text when fetched, else the snippet."""
+    if projection == "full":
+        body = extract_body_text(payload)
+        if body:
+            return body
+    return payload.get("snippet", "")
+
+
+class ProjectionStats:
+    """Thread-safe tally of response bytes and JSON parse time per message."""
+
+    def __init__(self, projection):
+        self.projection = projection
+        self.messages   = 0
+        self.bytes      = 0
+        self.parse_secs = 0.0
+        self._lock      = threading.Lock()
+
+    def record(self, nbytes, messages=1, parse_secs=0.0):
+        with self._lock:
+            self.bytes      += nbytes
+            self.messages   += messages
+            self.parse_secs += parse_secs
+
+    def summary(self):
+        per_msg = self.messages or 1
+        return {
+            "projection":   self.projection,
+            "messages":     self.messages,
+            "bytes":        self.bytes,
+            "avg_bytes":    round(self.bytes / per_msg),
+            "avg_parse_ms": round(self.parse_secs * 1000 / per_msg, 3),
+        }
@@ -0,0 +1,40 @@
+# gmail_fetch/rate_limiter.py
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket used to keep Gmail calls under quota.
+
+    `rate` tokens are added per second, up to `capacity`. `acquire()` blocks
+    until enough tokens are available, so any number of worker threads can
+    share one bucket.
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate     = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens  = self.capacity
+        self._last    = time.monotonic()
+        self._lock    = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self, tokens=1):
+        # a request larger than the bucket (e.g. a whole batch call) waits for
+        # a full bucket and then goes into debt, delaying later callers instead
+        needed = min(tokens, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
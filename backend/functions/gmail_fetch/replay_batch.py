@@ -0,0 +1,119 @@
+# gmail_fetch/replay_batch.py
+#
+# Offline check of the Gmail batch path against a captured batch response.
+# fixtures/batch_request.json holds the message IDs and messages.get query
+# the batch was sent with, and fixtures/batch_response.http the raw HTTP
+# response (status line, headers, multipart body). The replay re-encodes the
+# request with encode_batch_request, decodes the response with
+# decode_batch_response, checks every ID comes back with the expected status,
+# and compares round trips against one messages.get per message: 200s are
+# done, 404s are dropped, retryable statuses (429/5xx) are re-sent once and
+# other errors are given up on, the same rules fetch_message_details_batch
+# applies.
+#
+# The checked-in response is a hand-built sample in the batch endpoint's wire
+# format (synthetic messages plus one 404 and one 429 sub-response). To
+# replace it with a capture from a real mailbox (overwrites both files):
+#   GMAIL_ACCESS_TOKEN=... python replay_batch.py --record <msg_id> [<msg_id> ...]
+#
+# Run with: python replay_batch.py
+
+import json
+import math
+import os
+import sys
+import time
+
+from gmail_batch import BATCH_URL, MAX_BATCH_SIZE, encode_batch_request, decode_batch_response
+from http_client import RETRYABLE_STATUSES
+from projection import message_query
+
+FIXTURES      = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REQUEST_FILE  = os.path.join(FIXTURES, "batch_request.json")
+RESPONSE_FILE = os.path.join(FIXTURES, "batch_response.http")
+
+
+def load_fixture():
+    """(msg_ids, query, content_type, body_bytes) from the fixture files."""
+    with open(REQUEST_FILE) as f:
+        request = json.load(f)
+    with open(RESPONSE_FILE, "rb") as f:
+        raw = f.read()
+    head, _, body = raw.partition(b"\r\n\r\n")
+    content_type = next(
+        line.split(b":", 1)[1].strip().decode()
+        for line in head.split(b"\r\n") if line.lower().startswith(b"content-type:")
+    )
+    return request["msg_ids"], request["query"], content_type, body
+
+
+def record(msg_ids, projection="metadata"):
+    """Send one real batch request and save it as the fixture."""
+    import requests
+
+    token = os.environ["GMAIL_ACCESS_TOKEN"]
+    query = message_query(projection)
+    body, content_type = encode_batch_request(msg_ids, query=query)
+    resp = requests.post(BATCH_URL, data=body, timeout=30,
+                         headers={"Authorization": f"Bearer {token}", "Content-Type": content_type})
+    resp.raise_for_status()
+
+    os.makedirs(FIXTURES, exist_ok=True)
+    with open(REQUEST_FILE, "w") as f:
+        json.dump({"msg_ids": msg_ids, "query": query, "expected_status": {}}, f, indent=2)
+    head = [f"HTTP/1.1 {resp.status_code} {resp.reason}"] + [f"{k}: {v}" for k, v in resp.headers.items()]
+    with open(RESPONSE_FILE, "wb") as f:
+        f.write("\r\n".join(head).encode() + b"\r\n\r\n" + resp.content)
+    print(f"📼 Recorded batch response for {len(msg_ids)} message(s) to {RESPONSE_FILE}")
+
+
+def replay():
+    msg_ids, query, content_type, body = load_fixture()
+    with open(REQUEST_FILE) as f:
+        expected = json.load(f).get("expected_status", {})
+
+    # the request side: one sub-request per ID, Content-IDs in ID order
+    request_body, request_type = encode_batch_request(msg_ids, query=query)
+    request_text = request_body.decode()
+    assert request_type.startswith("multipart/mixed; boundary=")
+    for i, msg_id in enumerate(msg_ids):
+        assert f"Content-ID: <item-{i}>\r\n\r\nGET /gmail/v1/users/me/messages/{msg_id}?{query}" in request_text
+
+    started = time.perf_counter()
+    parts = decode_batch_response(body, content_type, msg_ids)
+    decode_ms = (time.perf_counter() - started) * 1000
+
+    assert list(parts) == msg_ids, "every requested ID must come back exactly once"
+    for msg_id, (status, payload) in parts.items():
+        if msg_id in expected:
+            assert status == expected[msg_id], (msg_id, status, expected[msg_id])
+        if status == 200:
+            assert payload and payload.get("id") == msg_id, msg_id
+
+    fetched = [m for m, (status, _) in parts.items() if status == 200]
+    gone    = [m for m, (status, _) in parts.items() if status == 404]
+    retried = [m for m, (status, _) in parts.items() if status == 0 or status in RETRYABLE_STATUSES]
+
+    # one GET per message, each retryable failure re-sent once
+    per_message = len(msg_ids) + len(retried)
+    # one batch, then one smaller batch for the retryable failures
+    batched = math.ceil(len(msg_ids) / MAX_BATCH_SIZE) + math.ceil(len(retried) / MAX_BATCH_SIZE)
+
+    return {
+        "messages":            len(msg_ids),
+        "fetched":             len(fetched),
+        "not_found_dropped":   len(gone),
+        "retried":             len(retried),
+        "response_bytes":      len(body),
+        "decode_ms":           round(decode_ms, 2),
+        "round_trips_per_message": per_message,
+        "round_trips_batched":     batched,
+        "round_trips_saved_pct":   round((1 - batched / per_message) * 100, 1),
+    }
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--record":
+        record(sys.argv[2:])
+    else:
+        print(json.dumps(replay(), indent=2))
@@ -0,0 +1,50 @@
+# gmail_fetch/scheduler.py
+#
+# Runs per-user syncs concurrently for /fetch. Users are ordered so the ones
+# that have waited longest since `last_fetched` go first, at most
+# `max_concurrency` run at a time, each gets a cooperative time budget, and
+# users that cannot start before the overall deadline are reported as skipped.
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prioritize(users):
+    """Sort (uid, creds) pairs by last_fetched, never-fetched users first."""
+    return sorted(users, key=lambda u: u[1].get("last_fetched", 0) or 0)
+
+
+def run_user_syncs(users, sync_fn, max_concurrency, user_budget_secs, total_budget_secs=None):
+    """Run sync_fn(uid, creds, deadline) for each user and collect results.
+
+    sync_fn must stop starting new work once time.monotonic() passes the
+    deadline it is given and return the number of emails fetched. Returns one
+    result dict per user, in priority order.
+    """
+    started = time.monotonic()
+    overall_deadline = started + total_budget_secs if total_budget_secs else None
+
+    def run_one(uid, creds):
+        begin = time.monotonic()
+        if overall_deadline and begin >= overall_deadline:
+            return {"uid": uid, "status": "skipped", "fetched": 0, "seconds": 0.0,
+                    "budget_exhausted": True, "error": "overall time budget exhausted before start"}
+
+        deadline = begin + user_budget_secs
+        if overall_deadline:
+            deadline = min(deadline, overall_deadline)
+        try:
+            fetched = sync_fn(uid, creds, deadline)
+            result = {"uid": uid, "status": "ok", "fetched": fetched}
+        except Exception as e:
+            print(f"❌ Error for {uid}: {e}")
+            result = {"uid": uid, "status": "error", "fetched": 0, "error": str(e)}
+
+        result["seconds"] = round(time.monotonic() - begin, 3)
+        result["budget_exhausted"] = time.monotonic() >= deadline
+        return result
+
+    ordered = prioritize(users)
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        futures = [pool.submit(run_one, uid, creds) for uid, creds in ordered]
+        return [f.result() for f in futures]
@@ -0,0 +1,68 @@
+# gmail_fetch/sharding.py
+#
+# Fan-out for /fetch across many gmail_fetch instances. A coordinator
+# partitions the gmail_auth user set into shards by hashing the UID and puts
+# one work item per shard on a queue; any worker that receives an item syncs
+# just that shard. The queue is pluggable: Pub/Sub in production, an
+# in-memory stand-in for running the whole flow locally.
+
+import hashlib
+import json
+import queue
+import uuid
+
+
+def shard_for_uid(uid, num_shards):
+    """Stable shard index for a UID (independent of PYTHONHASHSEED)."""
+    digest = hashlib.sha1(uid.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def partition_uids(uids, num_shards):
+    """Split UIDs into num_shards lists using shard_for_uid."""
+    shards = [[] for _ in range(num_shards)]
+    for uid in uids:
+        shards[shard_for_uid(uid, num_shards)].append(uid)
+    return shards
+
+
+def build_work_items(uids, num_shards, **options):
+    """One work item per non-empty shard, sharing a run_id and sync options."""
+    run_id = str(uuid.uuid4())
+    return [
+        {"run_id": run_id, "shard": i, "num_shards": num_shards, "uids": shard, **options}
+        for i, shard in enumerate(partition_uids(uids, num_shards))
+        if shard
+    ]
+
+
+class PubSubWorkQueue:
+    """Publishes work items as JSON to a Pub/Sub topic (push-delivered to /fetch/shard)."""
+
+    def __init__(self, publisher, topic):
+        self.publisher = publisher
+        self.topic     = topic
+
+    def publish(self, item):
+        data = json.dumps(item).encode("utf-8")
+        return self.publisher.publish(self.topic, data=data).result()
+
+
+class InMemoryWorkQueue:
+    """Process-local queue with the same publish() interface, for local runs."""
+
+    def __init__(self):
+        self._items = queue.Queue()
+
+    def publish(self, item):
+        self._items.put(item)
+
+    def drain(self, handler):
+        """Hand every queued item to handler(item); returns the handler results."""
+        results = []
+        while True:
+            try:
+                item = self._items.get_nowait()
+            except queue.Empty:
+                return results
+            results.append(handler(item))
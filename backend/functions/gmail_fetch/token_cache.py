@@ -0,0 +1,99 @@
+# gmail_fetch/token_cache.py
+#
+# Access-token cache so a sync only hits the OAuth token endpoint when the
+# stored token is close to expiry. Tokens live in an in-process LRU keyed by
+# UID and are written back to the gmail_auth doc (token + token_expiry) so
+# other instances and later runs can reuse them too. A per-UID lock makes
+# sure only one refresh per user is ever in flight in this process. Entries
+# remember which grant (refresh token) they came from, so a user who
+# reconnects a different Gmail account never gets the old account's token.
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def grant_fingerprint(creds_dict):
+    """Identifies the OAuth grant a gmail_auth doc holds (its refresh token)."""
+    secret = creds_dict.get("refresh_token") or creds_dict.get("token") or ""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """LRU of (access_token, expiry_epoch_secs, grant_fingerprint) per UID.
+
+    refresh_fn(creds_dict) -> (token, expiry_epoch_secs) performs the OAuth
+    refresh; persist_fn(uid, token, expiry_epoch_secs) stores the result.
+    """
+
+    def __init__(self, refresh_fn, persist_fn, max_entries=1024, skew_secs=300):
+        self.refresh_fn  = refresh_fn
+        self.persist_fn  = persist_fn
+        self.max_entries = max_entries
+        self.skew_secs   = skew_secs
+        self._entries    = OrderedDict()
+        self._lock       = threading.Lock()
+        self._uid_locks  = {}
+
+    def _fresh(self, expiry):
+        return expiry is not None and expiry - self.skew_secs > time.time()
+
+    def _cached(self, uid, grant):
+        with self._lock:
+            entry = self._entries.get(uid)
+            if entry and entry[2] == grant and self._fresh(entry[1]):
+                self._entries.move_to_end(uid)
+                return entry[0]
+            return None
+
+    def _store(self, uid, token, expiry, grant):
+        with self._lock:
+            self._entries[uid] = (token, expiry, grant)
+            self._entries.move_to_end(uid)
+            while len(self._entries) > self.max_entries:
+                # per-UID locks are kept: dropping one a refresh is holding
+                # would let a second refresh for that user start
+                self._entries.popitem(last=False)
+
+    def _uid_lock(self, uid):
+        with self._lock:
+            return self._uid_locks.setdefault(uid, threading.Lock())
+
+    def get_token(self, uid, creds_dict, force_refresh=False):
+        """Valid access token for uid, refreshing only when near expiry.
+
+        force_refresh skips both the cache and the token stored in creds_dict,
+        for when Gmail has just rejected the token (see invalidate).
+        """
+        grant = grant_fingerprint(creds_dict)
+        if not force_refresh:
+            token = self._cached(uid, grant)
+            if token:
+                return token
+
+        with self._uid_lock(uid):
+            # another thread may have refreshed while we waited for the lock
+            token = None if force_refresh else self._cached(uid, grant)
+            if token:
+                return token
+
+            stored_token  = creds_dict.get("token")
+            stored_expiry = creds_dict.get("token_expiry")
+            if not force_refresh and stored_token and self._fresh(stored_expiry):
+                self._store(uid, stored_token, stored_expiry, grant)
+                return stored_token
+
+            print(f"🔑 Refreshing access token for {uid}")
+            token, expiry = self.refresh_fn(creds_dict)
+            self._store(uid, token, expiry, grant)
+            try:
+                self.persist_fn(uid, token, expiry)
+            except Exception as e:
+                print(f"⚠️ Failed to persist refreshed token for {uid}: {e}")
+            return token
+
+    def invalidate(self, uid):
+        """Drop a cached token, e.g. after Gmail rejects it with 401."""
+        with self._lock:
+            self._entries.pop(uid, None)
@@ -0,0 +1,79 @@
+# manage_tokens/benchmark_oauth.py
+#
+# Per-request CPU cost of the auth-url and callback setup, before and after
+# OAuthClient: the old code built Flow.from_client_config(...) from a fresh
+# dict on every request (and called authorization_url for /auth-url); the new
+# code formats the prebuilt URL template with a signed state, or builds a
+# Flow straight from the frozen config. The callback's state check is new
+# work rather than a saving, so it is reported on its own. No network calls
+# are made (the callback's fetch_token round trip is the same either way).
+#
+# Run with: python benchmark_oauth.py [iterations]
+
+import json
+import sys
+import time
+
+from google_auth_oauthlib.flow import Flow
+
+from oauth_flow import OAuthClient, AUTH_URI, TOKEN_URI
+
+CLIENT_ID     = "1234567890-bench.apps.googleusercontent.com"
+CLIENT_SECRET = "bench-secret"
+REDIRECT_URI  = "https://example.com/api/gmail/callback"
+SCOPES = [
+    "https://www.googleapis.com/auth/gmail.readonly",
+    "https://www.googleapis.com/auth/gmail.labels",
+    "https://www.googleapis.com/auth/userinfo.email",
+    "https://www.googleapis.com/auth/userinfo.profile",
+    "openid"
+]
+
+
+def old_flow():
+    flow = Flow.from_client_config({
+        "web": {
+            "client_id": CLIENT_ID,
+            "client_secret": CLIENT_SECRET,
+            "redirect_uris": [REDIRECT_URI],
+            "auth_uri": AUTH_URI,
+            "token_uri": TOKEN_URI,
+        }
+    }, scopes=SCOPES)
+    flow.redirect_uri = REDIRECT_URI
+    return flow
+
+
+def old_auth_url():
+    auth_url, _ = old_flow().authorization_url(prompt="consent", access_type="offline",
+                                               include_granted_scopes="true")
+    return auth_url
+
+
+def cpu_us_per_call(fn, iterations):
+    fn()   # warm imports and caches
+    started = time.process_time()
+    for _ in range(iterations):
+        fn()
+    return (time.process_time() - started) / iterations * 1e6
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    oauth = OAuthClient(CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, SCOPES)
+
+    report = {}
+    for endpoint, old, new in (
+        ("auth_url", old_auth_url, lambda: oauth.auth_url("bench-uid")),
+        ("callback", old_flow,     oauth.flow),
+    ):
+        before = cpu_us_per_call(old, iterations)
+        after  = cpu_us_per_call(new, iterations)
+        report[endpoint] = {
+            "before_cpu_us": round(before, 1),
+            "after_cpu_us":  round(after, 1),
+            "saved_pct":     round((1 - after / before) * 100, 1),
+        }
+    state = oauth.sign_state("bench-uid")
+    report["callback"]["state_check_cpu_us"] = round(cpu_us_per_call(lambda: oauth.verify_state(state), iterations), 1)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,143 @@
+# manage_tokens/id_token_cache.py
+#
+# Firebase ID token verification without a network call on the hot path. The
+# securetoken signing certificates are downloaded in the background (and
+# again before their Cache-Control max-age runs out), tokens are verified
+# locally with google.auth.jwt against them, and verified claims are kept in
+# an LRU keyed by the token's SHA-256 until the token's own exp. The dashboard
+# polls with the same token, so after the first call a request costs one
+# hash and one dict lookup. Anything the local path cannot handle (certs not
+# loaded yet, unknown key id, ...) goes to firebase_admin's verify_id_token.
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+
+class CertificateStore:
+    """securetoken public certificates, refreshed on a daemon thread."""
+
+    def __init__(self, fetch_fn=None, min_refresh_secs=60, default_ttl_secs=3600):
+        self.fetch_fn         = fetch_fn or self._fetch
+        self.min_refresh_secs = min_refresh_secs
+        self.default_ttl_secs = default_ttl_secs
+        self.certs            = {}
+        self.expires_at       = 0.0
+        self.refreshes        = 0
+        self._ready           = threading.Event()
+        self._thread          = None
+
+    def _fetch(self):
+        import requests
+
+        response = requests.get(CERTS_URL, timeout=10)
+        response.raise_for_status()
+        match = _MAX_AGE_RE.search(response.headers.get("Cache-Control", ""))
+        return response.json(), int(match.group(1)) if match else self.default_ttl_secs
+
+    def refresh(self):
+        certs, max_age = self.fetch_fn()
+        self.certs      = certs        # swapped in one assignment; readers never see a partial dict
+        self.expires_at = time.time() + max_age
+        self.refreshes += 1
+        self._ready.set()
+        print(f"🔑 Loaded {len(certs)} securetoken certificates (max-age {max_age}s)")
+        return max_age
+
+    def start(self):
+        def loop():
+            while True:
+                try:
+                    max_age = self.refresh()
+                    # refresh well before Google stops serving the old keys
+                    wait = max(self.min_refresh_secs, max_age * 0.8)
+                except Exception as e:
+                    print(f"⚠️ Certificate refresh failed: {e}")
+                    wait = self.min_refresh_secs
+                time.sleep(wait)
+
+        if self._thread is None:
+            self._thread = threading.Thread(target=loop, name="securetoken-certs", daemon=True)
+            self._thread.start()
+
+    def ready(self):
+        return self._ready.is_set() and time.time() < self.expires_at
+
+
+class IdTokenVerifier:
+    """verify(id_token, project_id) -> decoded claims (with "uid"), cached until exp."""
+
+    def __init__(self, cert_store, fallback_fn, max_entries=10_000):
+        self.cert_store  = cert_store
+        self.fallback_fn = fallback_fn     # firebase_admin.auth.verify_id_token
+        self.max_entries = max_entries
+        self._entries    = OrderedDict()
+        self._lock       = threading.Lock()
+        self._stats = {"hits": 0, "local_verifications": 0, "fallback_verifications": 0}
+
+    def _cached(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry["exp"] <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry
+
+    def _remember(self, key, claims):
+        with self._lock:
+            self._entries[key] = claims
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _verify_locally(self, id_token, project_id):
+        from google.auth import jwt
+
+        claims = jwt.decode(id_token, certs=self.cert_store.certs, audience=project_id)
+        if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+            raise ValueError(f"unexpected issuer {claims.get('iss')}")
+        if not claims.get("sub") or len(claims["sub"]) > 128:
+            raise ValueError("missing or invalid sub claim")
+        claims["uid"] = claims["sub"]
+        return claims
+
+    def verify(self, id_token, project_id):
+        key = hashlib.sha256(id_token.encode("utf-8")).hexdigest()
+        now = time.time()
+        claims = self._cached(key, now)
+        if claims is not None:
+            return claims
+
+        claims = None
+        if self.cert_store.ready():
+            try:
+                claims = self._verify_locally(id_token, project_id)
+                kind = "local_verifications"
+            except Exception as e:
+                print(f"⚠️ Local ID token verification failed ({e}), using firebase_admin")
+        if claims is None:
+            # raises the usual firebase_admin errors for bad tokens
+            claims = self.fallback_fn(id_token)
+            kind = "fallback_verifications"
+
+        with self._lock:
+            self._stats[kind] += 1
+        self._remember(key, claims)
+        return claims
+
+    def metrics(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["entries"] = len(self._entries)
+        s["cert_refreshes"] = self.cert_store.refreshes
+        s["certs_ready"] = self.cert_store.ready()
+        return s
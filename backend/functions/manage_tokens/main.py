@@ -6,8 +6,11 @@ from flask_cors import CORS
 
 import firebase_admin
 from firebase_admin import auth, credentials
-from google.cloud import secretmanager_v1, firestore
-from google_auth_oauthlib.flow import Flow
+from google.cloud import firestore
+
+from id_token_cache import CertificateStore, IdTokenVerifier
+from oauth_flow import OAuthClient, InvalidState
+from secret_cache import SecretCache
 
 # === Flask App Setup ===
 app = Flask(__name__)
@@ -16,6 +19,10 @@ CORS(app, origins=["http://localhost:3000"], supports_credentials=True)
 firebase_app = None
 firestore_client = firestore.Client()
 
+PROJECT_ID      = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT")
+SECRET_TTL_SECS = int(os.getenv("SECRET_TTL_SECS", "600"))
+secrets = SecretCache(PROJECT_ID, ttl_secs=SECRET_TTL_SECS)
+
 # === Lazy Firebase Admin Init ===
 def get_firebase_app():
     global firebase_app
@@ -23,12 +30,7 @@ def get_firebase_app():
         return firebase_app
     print("🔑 Initializing Firebase Admin...")
     try:
-        project_id = os.getenv("GCP_PROJECT") or os.getenv("GOOGLE_CLOUD_PROJECT")
-        secret_name = "firebase-service-account"
-        name = f"projects/{project_id}/secrets/{secret_name}/versions/latest"
-        client = secretmanager_v1.SecretManagerServiceClient()
-        response = client.access_secret_version(request={"name": name})
-        service_account_info = json.loads(response.payload.data.decode("UTF-8"))
+        service_account_info = json.loads(get_secret("firebase-service-account"))
         print(f"✅ Service account info: {service_account_info.get('project_id')}")
         cred = credentials.Certificate(service_account_info)
         firebase_app = firebase_admin.initialize_app(cred)
@@ -40,15 +42,25 @@ def get_firebase_app():
 
 # === Fetch Secrets from Secret Manager ===
 def get_secret(secret_name):
-    client = secretmanager_v1.SecretManagerServiceClient()
-    name = f"projects/{os.getenv('GCP_PROJECT')}/secrets/{secret_name}/versions/latest"
-    response = client.access_secret_version(request={"name": name})
-    return response.payload.data.decode("UTF-8")
+    """Cached value; Secret Manager is only read at startup and by the refresher."""
+    return secrets.get(secret_name)
+
+def frontend_redirect_url():
+    if os.getenv("FRONTEND_REDIRECT_URL"):
+        return get_secret("FRONTEND_REDIRECT_URL")
+    return "http://localhost:3000/callback"
+
+# Everything a request can need, read in parallel once per container
+STARTUP_SECRETS = [
+    "GOOGLE_OAUTH_CLIENT_ID",
+    "GOOGLE_OAUTH_CLIENT_SECRET",
+    "GOOGLE_OAUTH_REDIRECT_URI",
+    "firebase-service-account",
+] + (["FRONTEND_REDIRECT_URL"] if os.getenv("FRONTEND_REDIRECT_URL") else [])
+secrets.prefetch(STARTUP_SECRETS)
+secrets.start_refresher()
 
 # === Config ===
-CLIENT_ID = get_secret("GOOGLE_OAUTH_CLIENT_ID")
-CLIENT_SECRET = get_secret("GOOGLE_OAUTH_CLIENT_SECRET")
-REDIRECT_URI = get_secret("GOOGLE_OAUTH_REDIRECT_URI")
 SCOPES = [
     "https://www.googleapis.com/auth/gmail.readonly",
     "https://www.googleapis.com/auth/gmail.labels",
@@ -57,7 +69,29 @@ SCOPES = [
     "openid"
 ]
 
+_oauth = (None, None)   # (secret values it was built from, OAuthClient)
+
+def oauth_client():
+    """Prebuilt OAuth client for the current secret values (rebuilt only if they rotate)."""
+    global _oauth
+    settings = (get_secret("GOOGLE_OAUTH_CLIENT_ID"),
+                get_secret("GOOGLE_OAUTH_CLIENT_SECRET"),
+                get_secret("GOOGLE_OAUTH_REDIRECT_URI"))
+    built_from, client = _oauth
+    if built_from != settings:
+        client = OAuthClient(*settings, scopes=SCOPES)
+        _oauth = (settings, client)
+    return client
+
+oauth_client()
+
 # === Token Verifier ===
+# Certificates load in the background; until they do, tokens go to firebase_admin
+cert_store = CertificateStore()
+cert_store.start()
+token_verifier = IdTokenVerifier(cert_store, fallback_fn=lambda t: auth.verify_id_token(t),
+                                 max_entries=int(os.getenv("ID_TOKEN_CACHE_SIZE", "10000")))
+
 def verify_firebase_token(request):
     print("🧪 Verifying Firebase token...")
     auth_header = request.headers.get("Authorization")
@@ -67,7 +101,7 @@ def verify_firebase_token(request):
     id_token = auth_header.split(" ")[1].encode('utf-8').decode('utf-8')  # Ensure UTF-8 handling
     print(f"🔍 Extracted ID token: {id_token[:50]}...")  # Log first 50 chars
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = token_verifier.verify(id_token, get_firebase_app().project_id)
         print(f"✅ Firebase UID: {decoded_token['uid']}, Exp: {decoded_token['exp']}")
         return decoded_token["uid"]
     except Exception as e:
@@ -78,26 +112,27 @@ def verify_firebase_token(request):
 @app.route("/api/debug", methods=["GET"])
 def debug():
     print("📡 Debug endpoint hit")
-    return jsonify({"status": "alive", "message": "Container is running"}), 200
+    return jsonify({"status": "alive", "message": "Container is running",
+                    "id_token_cache": token_verifier.metrics()}), 200
 
 @app.route("/api/gmail/auth-url", methods=["POST"])
 def get_auth_url():
     try:
         get_firebase_app()
         uid = verify_firebase_token(request)
+        oauth = oauth_client()
 
-        flow = Flow.from_client_config({
-            "web": {
-                "client_id": CLIENT_ID,
-                "client_secret": CLIENT_SECRET,
-                "redirect_uris": [REDIRECT_URI],
-                "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                "token_uri": "https://oauth2.googleapis.com/token",
-            }
-        }, scopes=SCOPES)
-        flow.redirect_uri = REDIRECT_URI
-        auth_url, _ = flow.authorization_url(prompt="consent", access_type="offline", include_granted_scopes="true")
+        # {"template": true}: the URL minus state is the same for every user and
+        # can be cached client-side; only the signed state is per request
+        if (request.get_json(silent=True) or {}).get("template"):
+            print(f"🔗 Auth URL template and state issued for {uid}")
+            return jsonify({
+                "authUrlTemplate":  oauth.url_template,
+                "statePlaceholder": "__STATE__",
+                "state":            oauth.sign_state(uid),
+            })
 
+        auth_url = oauth.auth_url(uid)
         print(f"🔗 Auth URL generated for {uid}")
         return jsonify({"authUrl": auth_url})
     except Exception as e:
@@ -115,35 +150,28 @@ def callback():
             
             if error:
                 print(f"❌ OAuth error: {error}")
-                frontend_url = get_secret("FRONTEND_REDIRECT_URL") if os.getenv("FRONTEND_REDIRECT_URL") else "http://localhost:3000/callback"
+                frontend_url = frontend_redirect_url()
                 return f'<script>window.location.href="{frontend_url}?error={error}";</script>', 400
             
             if not code:
                 print("❌ No authorization code in redirect")
-                frontend_url = get_secret("FRONTEND_REDIRECT_URL") if os.getenv("FRONTEND_REDIRECT_URL") else "http://localhost:3000/callback"
+                frontend_url = frontend_redirect_url()
                 return f'<script>window.location.href="{frontend_url}?error=missing_code";</script>', 400
             
             print(f"🔑 Authorization code received: {code}")
-            
-            # Extract UID from state parameter (we'll need to modify auth URL generation to include this)
-            # For now, we'll need a different approach since we don't have the UID
-            # Let's redirect to frontend with a special token that frontend can use
-            
+
+            # The signed state says which user started the flow
+            oauth = oauth_client()
+            try:
+                state_uid = oauth.verify_state(state or "")
+            except InvalidState as e:
+                print(f"❌ Invalid OAuth state: {e}")
+                frontend_url = frontend_redirect_url()
+                return f'<script>window.location.href="{frontend_url}?error=invalid_state";</script>', 400
+
             try:
                 # Exchange code for tokens immediately
-                flow = Flow.from_client_config(
-                    {
-                        "web": {
-                            "client_id": CLIENT_ID,
-                            "client_secret": CLIENT_SECRET,
-                            "redirect_uris": [REDIRECT_URI],
-                            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                            "token_uri": "https://oauth2.googleapis.com/token",
-                        }
-                    },
-                    scopes=SCOPES
-                )
-                flow.redirect_uri = REDIRECT_URI
+                flow = oauth.flow()
                 flow.fetch_token(code=code)
                 creds = flow.credentials
                 
@@ -163,20 +191,21 @@ def callback():
                     "client_id": creds.client_id,
                     "client_secret": creds.client_secret,
                     "scopes": creds.scopes,
+                    "uid": state_uid,
                     "created_at": firestore.SERVER_TIMESTAMP,
                     "expires_at": expiry_time
                 })
                 print(f"📦 Tokens stored temporarily with ID: {temp_id}")
                 
                 # Redirect to frontend with temp_id
-                frontend_url = get_secret("FRONTEND_REDIRECT_URL") if os.getenv("FRONTEND_REDIRECT_URL") else "http://localhost:3000/callback"
+                frontend_url = frontend_redirect_url()
                 redirect_url = f"{frontend_url}?temp_token_id={temp_id}&status=success"
                 print(f"🔀 Redirecting to frontend: {redirect_url}")
                 return f'<script>window.location.href="{redirect_url}";</script>', 200
                 
             except Exception as e:
                 print(f"❌ Error exchanging code for tokens: {str(e)}")
-                frontend_url = get_secret("FRONTEND_REDIRECT_URL") if os.getenv("FRONTEND_REDIRECT_URL") else "http://localhost:3000/callback"
+                frontend_url = frontend_redirect_url()
                 return f'<script>window.location.href="{frontend_url}?error={str(e)}";</script>', 500
 
         # For POST request (e.g., manual testing with code), require Firebase token
@@ -186,19 +215,7 @@ def callback():
         if not code:
             return jsonify({"error": "Missing auth code"}), 400
 
-        flow = Flow.from_client_config(
-            {
-                "web": {
-                    "client_id": CLIENT_ID,
-                    "client_secret": CLIENT_SECRET,
-                    "redirect_uris": [REDIRECT_URI],
-                    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-                    "token_uri": "https://oauth2.googleapis.com/token",
-                }
-            },
-            scopes=SCOPES
-        )
-        flow.redirect_uri = REDIRECT_URI
+        flow = oauth_client().flow()
         flow.fetch_token(code=code)
         creds = flow.credentials
 
@@ -234,6 +251,9 @@ def finalize_tokens():
             return jsonify({"error": "Temporary tokens not found or expired"}), 404
         
         temp_data = temp_doc.to_dict()
+        if temp_data.get("uid") and temp_data["uid"] != uid:
+            print(f"❌ Temporary tokens {temp_token_id} were issued to a different user")
+            return jsonify({"error": "Temporary tokens not found or expired"}), 404
         
         # Check if tokens have expired
         import datetime
@@ -295,28 +315,10 @@ def disconnect():
         get_firebase_app()
         uid = verify_firebase_token(request)
         
-        # Delete permanent tokens
+        # Delete permanent tokens. Expired temp-tokens are removed by
+        # temp_token_sweeper.py / the Firestore TTL policy, not here.
         firestore_client.collection("gmail_auth").document(uid).delete()
-        
-        # Clean up any temporary tokens that might exist for this user
-        # Note: This is a cleanup measure, though temp tokens aren't tied to UID
-        temp_tokens = firestore_client.collection("temp-tokens").get()
-        for doc in temp_tokens:
-            try:
-                # Delete old temporary tokens (older than 1 hour as cleanup)
-                import datetime
-                doc_data = doc.to_dict()
-                if "created_at" in doc_data:
-                    created_at = doc_data["created_at"]
-                    if hasattr(created_at, 'timestamp'):
-                        created_at = created_at.replace(tzinfo=None)
-                    current_time = datetime.datetime.utcnow()
-                    if current_time - created_at > datetime.timedelta(hours=1):
-                        firestore_client.collection("temp-tokens").document(doc.id).delete()
-                        print(f"🧹 Cleaned up old temporary token: {doc.id}")
-            except Exception as cleanup_error:
-                print(f"⚠️ Error cleaning temp token {doc.id}: {cleanup_error}")
-        
+
         print(f"🔌 Disconnected Gmail for {uid}")
         return jsonify({"status": "disconnected"})
     except Exception as e:
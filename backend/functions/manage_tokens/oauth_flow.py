@@ -0,0 +1,102 @@
+# manage_tokens/oauth_flow.py
+#
+# Google OAuth client settings built once per set of secrets instead of once
+# per request. The consent-screen URL is identical for every user except for
+# its state parameter, so it is kept as a prebuilt template and a request
+# only has to sign a state (uid + expiry, HMAC-SHA256 with a key derived from
+# the client secret) and append it. The callback verifies that state, which
+# also tells it which user started the flow. Token exchange still needs a
+# fresh Flow per request (the session holds the token), but it is built
+# straight from the frozen config without re-validating it.
+
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from types import MappingProxyType
+from urllib.parse import urlencode
+
+AUTH_URI  = "https://accounts.google.com/o/oauth2/auth"
+TOKEN_URI = "https://oauth2.googleapis.com/token"
+STATE_PLACEHOLDER = "__STATE__"
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class InvalidState(ValueError):
+    pass
+
+
+class OAuthClient:
+    """Immutable once built; rebuild it when the OAuth secrets change."""
+
+    def __init__(self, client_id, client_secret, redirect_uri, scopes, state_ttl_secs=900):
+        self.client_id      = client_id
+        self.redirect_uri   = redirect_uri
+        self.scopes         = tuple(scopes)
+        self.state_ttl_secs = state_ttl_secs
+        self.web_config = MappingProxyType({
+            "client_id":     client_id,
+            "client_secret": client_secret,
+            "redirect_uris": (redirect_uri,),
+            "auth_uri":      AUTH_URI,
+            "token_uri":     TOKEN_URI,
+        })
+        # client-secrets layout Flow expects: it looks the config up by client type
+        self.client_config = MappingProxyType({"web": self.web_config})
+        self._state_key = hmac.new(client_secret.encode(), b"oauth-state", hashlib.sha256).digest()
+        # same parameters Flow.authorization_url(prompt="consent", access_type="offline",
+        # include_granted_scopes="true") produces, minus the per-request state
+        self.url_template = AUTH_URI + "?" + urlencode({
+            "response_type":          "code",
+            "client_id":              client_id,
+            "redirect_uri":           redirect_uri,
+            "scope":                  " ".join(self.scopes),
+            "access_type":            "offline",
+            "prompt":                 "consent",
+            "include_granted_scopes": "true",
+        }) + "&state=" + STATE_PLACEHOLDER
+
+    def sign_state(self, uid, now=None):
+        payload = _b64(json.dumps({
+            "uid":   uid,
+            "exp":   int((time.time() if now is None else now) + self.state_ttl_secs),
+            "nonce": secrets.token_urlsafe(8),
+        }, separators=(",", ":")).encode())
+        signature = hmac.new(self._state_key, payload.encode(), hashlib.sha256).digest()
+        return f"{payload}.{_b64(signature)}"
+
+    def verify_state(self, state, now=None):
+        """Returns the uid the state was issued for; raises InvalidState."""
+        try:
+            payload, signature = state.split(".")
+            expected = hmac.new(self._state_key, payload.encode(), hashlib.sha256).digest()
+            if not hmac.compare_digest(expected, _unb64(signature)):
+                raise InvalidState("bad signature")
+            claims = json.loads(_unb64(payload))
+        except InvalidState:
+            raise
+        except Exception as e:
+            raise InvalidState(f"malformed state: {e}")
+        if claims.get("exp", 0) < (time.time() if now is None else now):
+            raise InvalidState("state expired")
+        return claims["uid"]
+
+    def auth_url(self, uid):
+        return self.url_template.replace(STATE_PLACEHOLDER, self.sign_state(uid))
+
+    def flow(self):
+        """A new Flow for one token exchange, without re-validating the config."""
+        from google_auth_oauthlib.flow import Flow
+        from requests_oauthlib import OAuth2Session
+
+        session = OAuth2Session(self.client_id, scope=list(self.scopes))
+        return Flow(session, "web", self.client_config, redirect_uri=self.redirect_uri)
@@ -0,0 +1,89 @@
+# manage_tokens/secret_cache.py
+#
+# Secret Manager values cached in process. One SecretManagerServiceClient is
+# shared by every read, the secrets a container needs are fetched in parallel
+# at startup, and a daemon thread re-reads them every ttl_secs so rotated
+# values are picked up without request handlers ever waiting on Secret
+# Manager. Only a secret nobody prefetched is read inline, once, on first use.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SecretCache:
+    """name -> (value, fetched_at) for the latest version of each secret."""
+
+    def __init__(self, project_id, ttl_secs=600, client_factory=None):
+        self.project_id      = project_id
+        self.ttl_secs        = ttl_secs
+        self._client_factory = client_factory
+        self._client         = None
+        self._values         = {}
+        self._lock           = threading.Lock()
+        self._refresher      = None
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                if self._client_factory is None:
+                    from google.cloud import secretmanager_v1
+                    self._client_factory = secretmanager_v1.SecretManagerServiceClient
+                self._client = self._client_factory()
+            return self._client
+
+    def _fetch(self, name):
+        path = f"projects/{self.project_id}/secrets/{name}/versions/latest"
+        response = self.client.access_secret_version(request={"name": path})
+        value = response.payload.data.decode("UTF-8")
+        with self._lock:
+            self._values[name] = (value, time.time())
+        return value
+
+    def get(self, name):
+        with self._lock:
+            entry = self._values.get(name)
+        if entry is not None:
+            return entry[0]     # stale values are replaced by the refresher, not here
+        print(f"⚠️ Secret {name} was not prefetched, reading it inline")
+        return self._fetch(name)
+
+    def prefetch(self, names):
+        """Fetch all names concurrently; returns the names that failed.
+
+        Failures are only logged: a secret that could not be prefetched is
+        read inline by get(), which raises the real error to its caller.
+        """
+        names = list(names)
+        if not names:
+            return []
+        self.client   # build the shared client once, before the workers race for it
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            futures = [pool.submit(self._fetch, name) for name in names]
+        failed = []
+        for name, future in zip(names, futures):
+            if future.exception() is not None:
+                print(f"⚠️ Could not prefetch secret {name}: {future.exception()}")
+                failed.append(name)
+        print(f"🔐 Prefetched {len(names) - len(failed)}/{len(names)} secrets "
+              f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return failed
+
+    def start_refresher(self):
+        """Re-read every cached secret each ttl_secs on a daemon thread."""
+        def loop():
+            while True:
+                time.sleep(self.ttl_secs)
+                with self._lock:
+                    names = list(self._values)
+                try:
+                    # per-secret failures keep serving the last good value
+                    self.prefetch(names)
+                except Exception as e:
+                    print(f"⚠️ Secret refresh failed: {e}")
+
+        if self._refresher is None:
+            self._refresher = threading.Thread(target=loop, name="secret-refresher", daemon=True)
+            self._refresher.start()
@@ -0,0 +1,87 @@
+# manage_tokens/temp_token_sweeper.py
+#
+# Deletes expired temp-tokens documents outside the request path. The OAuth
+# callback writes every temp token with an expires_at timestamp, so expired
+# ones are found with a range query on that field (served by Firestore's
+# automatic single-field index, ids only) and removed in WriteBatches of up
+# to 500, so the cost tracks the number of expired tokens rather than the
+# size of the collection. A Firestore TTL policy on expires_at (see
+# backend/README.md) does the same job server-side; this sweeper covers the
+# up-to-24h lag of TTL deletion and projects without a policy.
+#
+# Run with: python temp_token_sweeper.py             (e.g. a Cloud Run job on a schedule)
+#           python temp_token_sweeper.py --selftest  (against FIRESTORE_EMULATOR_HOST)
+
+import datetime
+import os
+import sys
+
+COLLECTION     = "temp-tokens"
+MAX_BATCH_OPS  = 500
+
+
+def sweep_expired_temp_tokens(client, now=None, batch_size=MAX_BATCH_OPS, collection=COLLECTION):
+    """Delete every doc whose expires_at is before now; returns how many were deleted."""
+    from google.cloud.firestore_v1.base_query import FieldFilter
+
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    batch_size = min(batch_size, MAX_BATCH_OPS)
+    deleted = 0
+    while True:
+        expired = list(
+            client.collection(collection)
+            .where(filter=FieldFilter("expires_at", "<", now))
+            .order_by("expires_at")
+            .select([])             # ids only, no token payloads
+            .limit(batch_size)
+            .stream()
+        )
+        if not expired:
+            break
+        batch = client.batch()
+        for doc in expired:
+            batch.delete(doc.reference)
+        batch.commit()
+        deleted += len(expired)
+        print(f"🧹 Deleted {len(expired)} expired temp tokens ({deleted} so far)")
+        if len(expired) < batch_size:
+            break
+    return deleted
+
+
+def _selftest():
+    """Seed the emulator with expired and live tokens and check only the expired ones go."""
+    from google.cloud import firestore
+
+    if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+        sys.exit("FIRESTORE_EMULATOR_HOST is not set; refusing to seed a real database")
+    client = firestore.Client(project=os.getenv("GOOGLE_CLOUD_PROJECT", "demo-onlyjobs"))
+    collection = "temp-tokens-selftest"
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    batch = client.batch()
+    for i in range(1203):
+        expires_at = now - datetime.timedelta(minutes=5) if i % 3 else now + datetime.timedelta(minutes=30)
+        batch.set(client.collection(collection).document(f"t{i}"), {"expires_at": expires_at})
+        if i % MAX_BATCH_OPS == MAX_BATCH_OPS - 1:
+            batch.commit()
+            batch = client.batch()
+    batch.commit()
+
+    deleted = sweep_expired_temp_tokens(client, now=now, batch_size=250, collection=collection)
+    remaining = [doc.id for doc in client.collection(collection).stream()]
+    assert deleted == 802, deleted
+    assert len(remaining) == 401 and all(int(d[1:]) % 3 == 0 for d in remaining), len(remaining)
+    for doc_id in remaining:
+        client.collection(collection).document(doc_id).delete()
+    print("✅ Sweeper self-test passed")
+
+
+if __name__ == "__main__":
+    if "--selftest" in sys.argv:
+        _selftest()
+    else:
+        from google.cloud import firestore
+
+        total = sweep_expired_temp_tokens(firestore.Client())
+        print(f"✅ Temp-token sweep finished, {total} deleted")
@@ -0,0 +1,76 @@
+# backend/services/process_emails/asgi_app.py
+# Purpose: Minimal ASGI front end so one instance can hold many emails in flight.
+
+# Functionality: create_asgi_app turns a {(method, path): handler} table into
+# an ASGI application. Handlers take the decoded JSON body (None for GET) and
+# return (body, status) like the Flask views; async handlers are awaited on the
+# event loop, so a request waiting on Gemini costs a coroutine rather than a
+# worker thread. Blocking client calls made through asyncio.to_thread share a
+# pool of blocking_workers threads, set up on lifespan startup.
+#
+# Serve with: gunicorn -k uvicorn.workers.UvicornWorker main:asgi_app
+
+import asyncio
+import inspect
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+
+async def _read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _respond(send, body, status):
+    if isinstance(body, (dict, list)):
+        data, content_type = json.dumps(body).encode(), b"application/json"
+    else:
+        data, content_type = str(body).encode(), b"text/plain; charset=utf-8"
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type),
+                            (b"content-length", str(len(data)).encode())]})
+    await send({"type": "http.response.body", "body": data})
+
+
+def create_asgi_app(routes, blocking_workers=64):
+    async def lifespan(receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                asyncio.get_running_loop().set_default_executor(
+                    ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix="blocking"))
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await lifespan(receive, send)
+
+        handler = routes.get((scope["method"], scope["path"]))
+        if handler is None:
+            return await _respond(send, "Not found", 404)
+
+        body = await _read_body(receive)
+        envelope = None
+        if body:
+            try:
+                envelope = json.loads(body)
+            except ValueError:
+                envelope = None   # handlers treat it like Flask's get_json(silent=True)
+
+        try:
+            result = handler(envelope)
+            if inspect.isawaitable(result):
+                result = await result
+        except Exception as e:
+            print(f"[ERROR] Unhandled error on {scope['method']} {scope['path']}: {e}")
+            return await _respond(send, "Internal error", 500)
+        await _respond(send, *result)
+
+    return app
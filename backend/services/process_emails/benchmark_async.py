@@ -0,0 +1,185 @@
+# backend/services/process_emails/benchmark_async.py
+# Purpose: Load-test the WSGI and ASGI serving modes against a stubbed model.
+
+# Functionality: Fires num_requests Pub/Sub push envelopes at concurrency
+# clients against the real handlers: (a) main.index through the Flask app on
+# a pool of WSGI_THREADS threads, as gunicorn --threads runs main:app, and
+# (b) main.asgi_app, which routes to main.index_async. Only the edges are
+# replaced: the "gemini", "bigquery", "firestore" and "publisher" clients are
+# re-registered in the client registry with fakes that sleep for typical
+# round-trip latencies, and the service runs with DEDUP_STORE=memory and
+# CLASSIFY_CACHE_STORE=none. Dedup, the group-commit writers, the raw-content
+# archive and the thread hand-offs all run as in production. Reports
+# requests/sec and p50/p99 latency.
+#
+# Run with: python benchmark_async.py [num_requests] [concurrency]
+
+import asyncio
+import base64
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+os.environ.setdefault("DEDUP_STORE",          "memory")
+os.environ.setdefault("CLASSIFY_CACHE_STORE", "none")
+os.environ.setdefault("PREFILTER_ENABLED",    "false")   # every email reaches the model
+os.environ.setdefault("BQ_WRITE_MODE",        "legacy")  # insert_rows_json on the fake client
+os.environ.setdefault("CLIENT_WARMUP",        "off")
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import main
+    from clients import registry
+
+LLM_SECS       = 0.40   # Gemini call
+BQ_SECS        = 0.08   # insert_rows_json round trip
+FIRESTORE_SECS = 0.03   # batch commit round trip
+WSGI_THREADS   = 8      # gunicorn --threads in the Dockerfile
+
+CLASSIFICATION = "Company: Acme\nJob Title: Engineer\nLocation: Remote\nStatus: Applied"
+
+
+class StubModel:
+    def generate_content(self, prompt):
+        time.sleep(LLM_SECS)
+        return SimpleNamespace(text=CLASSIFICATION)
+
+    async def generate_content_async(self, prompt):
+        await asyncio.sleep(LLM_SECS)
+        return SimpleNamespace(text=CLASSIFICATION)
+
+
+class FakeBigQuery:
+    def dataset(self, dataset_id):
+        return SimpleNamespace(table=lambda table_id: f"{dataset_id}.{table_id}")
+
+    def insert_rows_json(self, table_ref, rows, row_ids=None):
+        time.sleep(BQ_SECS)
+        return []
+
+
+class FakeFirestore:
+    def collection(self, name):
+        return self
+
+    def document(self, doc_id):
+        return self
+
+    def set(self, data):
+        time.sleep(FIRESTORE_SECS)
+
+    def batch(self):
+        return SimpleNamespace(set=lambda ref, data: None, commit=lambda: time.sleep(FIRESTORE_SECS))
+
+
+class FakePublisher:
+    def publish(self, topic, data, **attrs):
+        return None
+
+
+registry.register("gemini",    StubModel)
+registry.register("bigquery",  FakeBigQuery)
+registry.register("firestore", FakeFirestore)
+registry.register("publisher", FakePublisher)
+main._bq_schema_ready = True   # nothing to create on the fake client
+
+
+def make_envelope(mode, i):
+    payload = {"user_id": "bench-user", "email_id": f"{mode}-{i}", "email_content": f"{mode} email body {i}"}
+    return {"message": {"data": base64.b64encode(json.dumps(payload).encode()).decode()}}
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+    return {
+        "requests_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms":           round(pick(0.50) * 1000, 1),
+        "p99_ms":           round(pick(0.99) * 1000, 1),
+    }
+
+
+def run_wsgi(n, concurrency):
+    """Clients queue on the fixed thread pool like requests queue on gunicorn threads."""
+    pool = ThreadPoolExecutor(max_workers=WSGI_THREADS)
+
+    def handle(envelope):
+        response = main.app.test_client().post("/", json=envelope)
+        assert response.status_code == 200, response.get_data(as_text=True)
+
+    def client(indices):
+        latencies = []
+        for i in indices:
+            started = time.perf_counter()
+            pool.submit(handle, make_envelope("wsgi", i)).result()
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        results = clients.map(client, [range(c, n, concurrency) for c in range(concurrency)])
+        latencies = [lat for chunk in results for lat in chunk]
+    elapsed = time.perf_counter() - started
+    pool.shutdown()
+    return summarize(latencies, elapsed)
+
+
+async def run_asgi(n, concurrency):
+    app = main.asgi_app
+
+    startup = asyncio.Queue()
+    await startup.put({"type": "lifespan.startup"})
+    lifespan_sent = []
+
+    async def lifespan_send(message):
+        lifespan_sent.append(message)
+    lifespan = asyncio.create_task(app({"type": "lifespan"}, startup.get, lifespan_send))
+    while not lifespan_sent:
+        await asyncio.sleep(0)
+
+    async def request(i):
+        body = json.dumps(make_envelope("asgi", i)).encode()
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await app({"type": "http", "method": "POST", "path": "/"}, receive, send)
+        assert sent[0]["status"] == 200, sent
+
+    async def client(indices):
+        latencies = []
+        for i in indices:
+            started = time.perf_counter()
+            await request(i)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(client(range(c, n, concurrency)) for c in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    await startup.put({"type": "lifespan.shutdown"})
+    await lifespan
+    return summarize([lat for chunk in results for lat in chunk], elapsed)
+
+
+if __name__ == "__main__":
+    n           = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    report = {"requests": n, "concurrency": concurrency}
+    # the handlers log every step; keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        report["wsgi_threads"] = run_wsgi(n, concurrency)
+        report["asgi"]         = asyncio.run(run_asgi(n, concurrency))
+    report["speedup"] = round(report["asgi"]["requests_per_sec"] / report["wsgi_threads"]["requests_per_sec"], 1)
+    report["writers"] = {name: main.collect_metrics()[name]
+                         for name in ("bigquery_writer", "firestore_writer")}
+    print(json.dumps(report, indent=2))
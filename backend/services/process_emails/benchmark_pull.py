@@ -0,0 +1,124 @@
+# backend/services/process_emails/benchmark_pull.py
+# Purpose: Compare push-path and pull-worker throughput without GCP.
+
+# Functionality: Feeds the same synthetic emails through (a) the push path's
+# per-request sequence (classify, BigQuery insert, Firestore set, publish)
+# and (b) MicroBatchWorker, using fakes that sleep for configurable latencies
+# in place of Vertex AI, BigQuery, Firestore and Pub/Sub.
+#
+# Run with: python benchmark_pull.py [num_emails]
+
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from pull_worker import MicroBatchWorker
+
+LLM_SECS       = 0.40   # Gemini call
+BQ_SECS        = 0.08   # insert_rows_json round trip
+FIRESTORE_SECS = 0.03   # set() / batch commit round trip
+PUBLISH_SECS   = 0.02   # Pub/Sub publish round trip
+
+
+def dockerfile_threads(default=1):
+    """gunicorn --threads of the WSGI command in the Dockerfile, so push runs at its real concurrency."""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Dockerfile")
+    try:
+        with open(path) as f:
+            match = re.search(r"--threads[ =](\d+)", f.read())
+    except OSError:
+        return default
+    return int(match.group(1)) if match else default
+
+
+PUSH_THREADS   = dockerfile_threads()
+
+
+def fake_classify(payload):
+    time.sleep(LLM_SECS)
+    if int(payload["email_id"].split("-")[1]) % 3 == 0:
+        return None, "not job application"
+    return {"Company": "Acme", "Job Title": "Engineer", "Location": "Remote", "status": "Applied"}, None
+
+
+def fake_build_records(payload, details):
+    return {"email_id": payload["email_id"], **details}, dict(details)
+
+
+def fake_bq_write(rows):
+    time.sleep(BQ_SECS)
+    return []
+
+
+def fake_fs_write(docs):
+    time.sleep(FIRESTORE_SECS)
+    return set()
+
+
+def fake_publish(email_ids):
+    time.sleep(PUBLISH_SECS)
+
+
+class FakeSubscriber:
+    def __init__(self, payloads):
+        self.pending = [
+            SimpleNamespace(ack_id=f"ack-{i}", message=SimpleNamespace(
+                data=json.dumps(p).encode("utf-8"), message_id=p["email_id"]))
+            for i, p in enumerate(payloads)
+        ]
+        self.acked = 0
+
+    def pull(self, request, timeout=None):
+        batch, self.pending = self.pending[:request["max_messages"]], self.pending[request["max_messages"]:]
+        return SimpleNamespace(received_messages=batch)
+
+    def acknowledge(self, request):
+        self.acked += len(request["ack_ids"])
+
+    def modify_ack_deadline(self, request):
+        pass
+
+
+def make_payloads(n):
+    return [{"user_id": "bench-user", "email_id": f"email-{i}", "email_content": f"email body {i}"}
+            for i in range(n)]
+
+
+def push_path(payloads):
+    def handle(payload):
+        details, _ = fake_classify(payload)
+        if details is None:
+            return
+        bq_row, doc = fake_build_records(payload, details)
+        fake_bq_write([bq_row])
+        fake_fs_write([(payload["user_id"], payload["email_id"], doc)])
+        fake_publish([payload["email_id"]])
+
+    with ThreadPoolExecutor(max_workers=PUSH_THREADS) as pool:
+        list(pool.map(handle, payloads))
+
+
+def pull_path(payloads):
+    subscriber = FakeSubscriber(payloads)
+    worker = MicroBatchWorker(subscriber, "bench-sub", fake_classify, fake_build_records,
+                              fake_bq_write, fake_fs_write, fake_publish,
+                              max_messages=50, max_wait_secs=0.05, concurrency=16)
+    while subscriber.pending:
+        worker.process_batch(worker.pull_batch())
+    return subscriber.acked
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    report = {"push_threads": PUSH_THREADS}
+    for name, run in (("push", push_path), ("pull_micro_batch", pull_path)):
+        started = time.perf_counter()
+        run(make_payloads(n))
+        elapsed = time.perf_counter() - started
+        report[name] = {"seconds": round(elapsed, 2), "emails_per_sec": round(n / elapsed, 1)}
+    report["speedup"] = round(report["pull_micro_batch"]["emails_per_sec"] / report["push"]["emails_per_sec"], 1)
+    print(json.dumps(report, indent=2))
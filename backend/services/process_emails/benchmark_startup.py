@@ -0,0 +1,66 @@
+# backend/services/process_emails/benchmark_startup.py
+# Purpose: Measure process_emails cold-start cost under each CLIENT_WARMUP mode.
+
+# Functionality: For each mode (eager = build every client during import, as
+# before; background; off) a fresh interpreter imports main, then sends one
+# push request through the Flask test client. The request is a newsletter the
+# prefilter rejects, so it only touches the dedup store in Firestore (one
+# lookup plus one processed_emails doc, which has a TTL) and never calls
+# Gemini or BigQuery. Reports import time, time to first response and
+# per-client init times. It needs the same credentials as the service.
+#
+# Run with: python benchmark_startup.py [runs_per_mode]
+
+import json
+import os
+import subprocess
+import sys
+
+PROBE = r"""
+import base64, json, time, uuid
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+payload = {
+    "user_id": "startup-benchmark",
+    "email_id": f"startup-benchmark-{uuid.uuid4().hex}",
+    "from": "news@digest.example.com",
+    "subject": "Your weekly digest",
+    "email_content": "Top stories this week. Unsubscribe from this newsletter at any time.",
+    "headers": {"List-Unsubscribe": "<mailto:unsubscribe@example.com>"},
+}
+envelope = {"message": {"data": base64.b64encode(json.dumps(payload).encode()).decode()}}
+response = main.app.test_client().post("/", json=envelope)
+responded = time.perf_counter()
+
+print("RESULT " + json.dumps({
+    "import_secs":         round(imported - started, 3),
+    "first_response_secs": round(responded - started, 3),
+    "status":              response.status_code,
+    "clients":             main.registry.metrics()["init_ms"],
+}))
+"""
+
+
+def run_probe(mode):
+    env = dict(os.environ, CLIENT_WARMUP=mode)
+    out = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True,
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+    for line in out.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"probe failed for CLIENT_WARMUP={mode}:\n{out.stderr[-2000:]}")
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    report = {}
+    for mode in ("eager", "background", "off"):
+        results = [run_probe(mode) for _ in range(runs)]
+        report[mode] = {
+            "import_secs":         round(sum(r["import_secs"] for r in results) / runs, 3),
+            "first_response_secs": round(sum(r["first_response_secs"] for r in results) / runs, 3),
+            "client_init_ms":      results[-1]["clients"],
+        }
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,162 @@
+# backend/services/process_emails/bq_writer.py
+# Purpose: Buffer BigQuery rows across requests and write them in bulk.
+
+# Functionality: BufferedBigQueryWriter collects rows from any number of
+# request threads and flushes them when BQ_FLUSH_MAX_ROWS accumulate or the
+# oldest row is BQ_FLUSH_MAX_AGE_SECS old. Callers block on a future until
+# the flush containing their rows has landed, so Pub/Sub is still only acked
+# after the data is durable. Flushes go through the Storage Write API on a
+# COMMITTED stream with explicit offsets (a retried append at the same offset
+# is rejected as ALREADY_EXISTS instead of duplicating rows); if that path
+# fails the batch falls back to the legacy streaming insert with
+# insertId = email_id. drain() flushes whatever is left on shutdown.
+
+import time
+from datetime import datetime, timezone
+
+from write_buffer import GroupCommitBuffer
+
+
+class StorageWriteBackend:
+    """Appends rows to a COMMITTED write stream with explicit offsets."""
+
+    def __init__(self, project, dataset, table, schema, max_retries=3):
+        # imported lazily so the legacy path works without these packages
+        from google.cloud import bigquery_storage_v1
+        from google.cloud.bigquery_storage_v1 import types, writer
+        from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+        self._types       = types
+        self._writer      = writer
+        self._client_cls  = bigquery_storage_v1.BigQueryWriteClient
+        self.client       = None   # built on the first append, not at import
+        self.parent       = f"projects/{project}/datasets/{dataset}/tables/{table}"
+        self.max_retries  = max_retries
+        self._timestamps  = {f.name for f in schema if f.field_type == "TIMESTAMP"}
+        self._stream      = None
+        self._append      = None
+        self._offset      = 0
+
+        # build a proto2 message type mirroring the table schema
+        file_proto = descriptor_pb2.FileDescriptorProto(name="job_application_row.proto",
+                                                        package="onlyjobs", syntax="proto2")
+        row_proto = file_proto.message_type.add(name="Row")
+        for number, field in enumerate(schema, start=1):
+            row_proto.field.add(
+                name=field.name,
+                number=number,
+                label=descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL,
+                type=(descriptor_pb2.FieldDescriptorProto.TYPE_INT64 if field.name in self._timestamps
+                      else descriptor_pb2.FieldDescriptorProto.TYPE_STRING),
+            )
+        pool = descriptor_pool.DescriptorPool()
+        pool.Add(file_proto)
+        self._row_class = message_factory.GetMessageClass(pool.FindMessageTypeByName("onlyjobs.Row"))
+        self._row_descriptor = row_proto
+
+    def _open(self):
+        types = self._types
+        if self.client is None:
+            self.client = self._client_cls()
+        self._stream = self.client.create_write_stream(
+            parent=self.parent,
+            write_stream=types.WriteStream(type_=types.WriteStream.Type.COMMITTED),
+        )
+        self._offset = 0
+
+        template = types.AppendRowsRequest(write_stream=self._stream.name)
+        proto_schema = types.ProtoSchema()
+        proto_schema.proto_descriptor = self._row_descriptor
+        template.proto_rows = types.AppendRowsRequest.ProtoData(writer_schema=proto_schema)
+        self._append = self._writer.AppendRowsStream(self.client, template)
+        print(f"[DEBUG] Opened BigQuery write stream {self._stream.name}")
+
+    def _serialize(self, row):
+        msg = self._row_class()
+        for name, value in row.items():
+            if value is None:
+                continue
+            if name in self._timestamps:
+                ts = datetime.fromisoformat(value)
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                value = int(ts.timestamp() * 1_000_000)
+            setattr(msg, name, value)
+        return msg.SerializeToString()
+
+    def write(self, rows):
+        """Append rows at the current offset; raises if the append cannot land."""
+        from google.api_core.exceptions import AlreadyExists
+
+        if self._append is None:
+            self._open()
+        types = self._types
+        proto_rows = types.ProtoRows(serialized_rows=[self._serialize(r) for r in rows])
+        request = types.AppendRowsRequest(
+            offset=self._offset,
+            proto_rows=types.AppendRowsRequest.ProtoData(rows=proto_rows),
+        )
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._append.send(request).result()
+                break
+            except AlreadyExists:
+                # an earlier attempt at this offset already committed
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    self.close()
+                    raise
+                print(f"[WARN] Storage Write append failed (attempt {attempt + 1}): {e}")
+                time.sleep(min(2 ** attempt, 5))
+        self._offset += len(rows)
+        return []
+
+    def close(self):
+        if self._append is not None:
+            try:
+                self._append.close()
+                self.client.finalize_write_stream(name=self._stream.name)
+            except Exception as e:
+                print(f"[WARN] Failed to finalize write stream: {e}")
+        self._append = None
+        self._stream = None
+
+
+class BufferedBigQueryWriter(GroupCommitBuffer):
+    """Group-commit buffer in front of a primary and a fallback row writer.
+
+    Both return insert_rows_json-style errors ([{"index": i, "errors": [...]}]);
+    when primary_fn raises, the whole flush is retried through fallback_fn
+    (if there is one).
+    """
+
+    name = "BigQuery writer"
+
+    def __init__(self, primary_fn, fallback_fn, max_rows=500, max_age_secs=0.05, name=None):
+        self.primary_fn       = primary_fn
+        self.fallback_fn      = fallback_fn
+        self.fallback_flushes = 0
+        if name:
+            self.name = name
+        super().__init__(max_rows, max_age_secs)
+
+    def _write(self, rows):
+        try:
+            errors = self.primary_fn(rows)
+        except Exception as e:
+            if self.fallback_fn is None:
+                raise
+            print(f"[WARN] Primary BigQuery write failed, using streaming insert: {e}")
+            self.fallback_flushes += 1
+            errors = self.fallback_fn(rows)
+        return {err["index"]: err["errors"] for err in errors or []}
+
+    def write(self, rows, timeout=None):
+        """Queue rows and block until they are flushed; returns their insert errors."""
+        errors = self.submit(rows).result(timeout=timeout)
+        return [{"index": i, "errors": errors[i]} for i in sorted(errors)]
+
+    def metrics(self):
+        return {**super().metrics(), "fallback_flushes": self.fallback_flushes}
@@ -0,0 +1,237 @@
+# backend/services/process_emails/classification_cache.py
+# Purpose: Avoid paying for Gemini twice on the same email content.
+
+# Functionality: Results of classify_email are cached under a hash of the
+# normalized email text plus the prompt version, so ATS template mails and
+# Pub/Sub redeliveries are answered without an LLM call. Lookups go through a
+# bounded in-memory LRU first and then a persistent store (Firestore in
+# production, SQLite locally); both tiers expire entries after a TTL.
+
+import asyncio
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def cache_key(email_content: str, prompt_version: str, max_chars: int = 4000) -> str:
+    """Hash of the normalized text the prompt actually sees, plus its version."""
+    normalized = _WHITESPACE_RE.sub(" ", email_content[:max_chars]).strip()
+    return hashlib.sha256(f"{prompt_version}\n{normalized}".encode("utf-8")).hexdigest()
+
+
+class FirestoreCacheStore:
+    """Persistent tier in a Firestore collection (pair with a TTL policy on expires_at)."""
+
+    def __init__(self, client, collection="classification_cache"):
+        self.client          = client
+        self.collection_name = collection
+
+    @property
+    def collection(self):
+        # resolved per call so constructing the store doesn't build the client
+        return self.client.collection(self.collection_name)
+
+    def get(self, key):
+        doc = self.collection.document(key).get()
+        if not doc.exists:
+            return None
+        data = doc.to_dict()
+        return data.get("result"), data.get("expires_at_ts", 0)
+
+    def set(self, key, result, expires_at):
+        self.collection.document(key).set({
+            "result":        result,
+            "expires_at_ts": expires_at,
+            "expires_at":    datetime.fromtimestamp(expires_at, timezone.utc),   # TTL policy field
+        })
+
+
+class SQLiteCacheStore:
+    """Persistent tier in a local SQLite file, for running without Firestore."""
+
+    def __init__(self, path="classification_cache.db"):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, result TEXT, expires_at REAL)"
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT result, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def set(self, key, result, expires_at):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?)", (key, result, expires_at))
+            self._conn.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+
+class ClassificationCache:
+    """Two-tier TTL cache in front of a classify function."""
+
+    def __init__(self, prompt_version, store=None, max_entries=10_000, ttl_secs=7 * 24 * 3600):
+        self.prompt_version = prompt_version
+        self.store          = store
+        self.max_entries    = max_entries
+        self.ttl_secs       = ttl_secs
+        self._entries       = OrderedDict()
+        self._lock          = threading.Lock()
+        self._stats = {"memory_hits": 0, "store_hits": 0, "misses": 0, "llm_seconds": 0.0}
+
+    def _remember(self, key, result, expires_at):
+        with self._lock:
+            self._entries[key] = (result, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _lookup_memory(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self._stats["memory_hits"] += 1
+            return entry[0]
+
+    def _lookup_store(self, key, now):
+        if self.store is None:
+            return None
+        try:
+            entry = self.store.get(key)
+        except Exception as e:
+            print(f"[WARN] Classification cache store read failed: {e}")
+            return None
+        if not entry or entry[1] < now:
+            return None
+        self._remember(key, entry[0], entry[1])
+        with self._lock:
+            self._stats["store_hits"] += 1
+        return entry[0]
+
+    def get_or_classify(self, email_content, classify_fn):
+        """Cached classify_fn(email_content); only misses reach the LLM."""
+        key = cache_key(email_content, self.prompt_version)
+        now = time.time()
+
+        result = self._lookup_memory(key, now)
+        if result is None:
+            result = self._lookup_store(key, now)
+        if result is not None:
+            print(f"[DEBUG] Classification cache hit for {key[:12]}")
+            return result
+
+        started = time.perf_counter()
+        result = classify_fn(email_content)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["llm_seconds"] += elapsed
+
+        expires_at = now + self.ttl_secs
+        self._remember(key, result, expires_at)
+        self._save_store(key, result, expires_at)
+        return result
+
+    async def get_or_classify_async(self, email_content, classify_fn):
+        """get_or_classify for an async classify_fn; store I/O runs in a worker thread."""
+        key = cache_key(email_content, self.prompt_version)
+        now = time.time()
+
+        result = self._lookup_memory(key, now)
+        if result is None and self.store is not None:
+            result = await asyncio.to_thread(self._lookup_store, key, now)
+        if result is not None:
+            print(f"[DEBUG] Classification cache hit for {key[:12]}")
+            return result
+
+        started = time.perf_counter()
+        result = await classify_fn(email_content)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._stats["misses"] += 1
+            self._stats["llm_seconds"] += elapsed
+
+        expires_at = now + self.ttl_secs
+        self._remember(key, result, expires_at)
+        if self.store is not None:
+            await asyncio.to_thread(self._save_store, key, result, expires_at)
+        return result
+
+    def get_or_classify_many(self, email_contents, classify_many_fn, prompt_version=None, max_chars=4000):
+        """Cached results for a list of emails; the misses go to classify_many_fn in one call.
+
+        classify_many_fn takes a list of email contents and returns one result
+        per content, in order. Identical contents in the list are classified once.
+        A classify_many_fn with its own prompt passes that prompt's version and
+        the number of characters it sees, so its entries are keyed apart.
+        """
+        version = prompt_version or self.prompt_version
+        keys = [cache_key(content, version, max_chars) for content in email_contents]
+        now = time.time()
+
+        results, misses = {}, {}
+        for key, content in zip(keys, email_contents):
+            if key in results or key in misses:
+                continue
+            result = self._lookup_memory(key, now)
+            if result is None:
+                result = self._lookup_store(key, now)
+            if result is None:
+                misses[key] = content
+            else:
+                results[key] = result
+        if results:
+            print(f"[DEBUG] Classification cache hits for {len(results)} of {len(email_contents)} emails")
+
+        if misses:
+            started = time.perf_counter()
+            classified = classify_many_fn(list(misses.values()))
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._stats["misses"] += len(misses)
+                self._stats["llm_seconds"] += elapsed
+
+            expires_at = now + self.ttl_secs
+            for key, result in zip(misses, classified):
+                results[key] = result
+                self._remember(key, result, expires_at)
+                self._save_store(key, result, expires_at)
+        return [results[key] for key in keys]
+
+    def _save_store(self, key, result, expires_at):
+        if self.store is None:
+            return
+        try:
+            self.store.set(key, result, expires_at)
+        except Exception as e:
+            print(f"[WARN] Classification cache store write failed: {e}")
+
+    def metrics(self):
+        with self._lock:
+            s = dict(self._stats)
+            size = len(self._entries)
+        hits = s["memory_hits"] + s["store_hits"]
+        lookups = hits + s["misses"]
+        avg_llm = s["llm_seconds"] / s["misses"] if s["misses"] else 0.0
+        return {
+            "memory_hits":           s["memory_hits"],
+            "store_hits":            s["store_hits"],
+            "misses":                s["misses"],
+            "hit_rate":              round(hits / lookups, 3) if lookups else 0.0,
+            "avg_llm_latency_ms":    round(avg_llm * 1000, 1),
+            # each hit saves roughly one average LLM call
+            "llm_seconds_saved_est": round(hits * avg_llm, 2),
+            "memory_entries":        size,
+        }
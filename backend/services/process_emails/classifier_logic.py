@@ -1,11 +1,13 @@
 # backend/services/process_emails/classifier_logic.py
 # Purpose: This is the core "intelligence" module.
 
-# Functionality: It initializes the Vertex AI client and loads the Gemini 2.5 Flash model. It contains the is_job_application function (though main.py might bypass it if the primary check is in classify_email) and, most importantly, the classify_email function. This function takes raw email content, sends it to Gemini, and parses Gemini's response into structured job application details (Company, Job Title, Status, Location).
+# Functionality: It registers the Vertex AI client and Gemini 2.5 Flash model, built on first use (see clients.py). It contains the is_job_application function (though main.py might bypass it if the primary check is in classify_email) and, most importantly, the classify_email function. This function takes raw email content, sends it to Gemini, and parses Gemini's response into structured job application details (Company, Job Title, Status, Location).
 
-import vertexai
-from vertexai.generative_models import GenerativeModel
+import json
 import os # Added for config import
+from concurrent.futures import ThreadPoolExecutor
+
+from clients import registry
 
 # Import configuration (assuming config.py is at the backend root)
 # You might need to adjust sys.path if importing from parent directory in a complex setup.
@@ -14,9 +16,21 @@ import os # Added for config import
 # --- FIX APPLIED HERE ---
 from config import PROJECT_ID, LOCATION # Corrected import to find config.py from project root
 
-# Initialize Vertex AI — Gemini models must use a supported region like us-central1
-vertexai.init(project=PROJECT_ID, location=LOCATION) # Use config variables
-gemini_model = GenerativeModel("gemini-2.5-flash") # As per your code
+def _build_gemini_model():
+    # vertexai is slow to import and init, so both happen on first use (or warm-up)
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+
+    # Initialize Vertex AI — Gemini models must use a supported region like us-central1
+    vertexai.init(project=PROJECT_ID, location=LOCATION) # Use config variables
+    return GenerativeModel("gemini-2.5-flash") # As per your code
+
+registry.register("gemini", _build_gemini_model)
+gemini_model = registry.proxy("gemini")
+
+# Bump whenever the classify_email prompt or model changes; cached
+# classifications are keyed by it (see classification_cache.py).
+PROMPT_VERSION = "gemini-2.5-flash/v1"
 
 def is_job_application(snippet: str) -> bool:
     """Determine if an email snippet is related to a job application."""
@@ -28,7 +42,7 @@ def is_job_application(snippet: str) -> bool:
     response = gemini_model.generate_content(prompt)
     return response.text.strip().lower() == "yes"
 
-def classify_email(email_content: str) -> str:
+def classify_email(email_content: str, model=None) -> str:
     """
     Analyze an email and extract job application details if applicable.
 
@@ -40,7 +54,16 @@ def classify_email(email_content: str) -> str:
             Status: ...
         - Or "Not Job Application" if irrelevant.
     """
-    prompt = (
+    response = (model or gemini_model).generate_content(classification_prompt(email_content))
+    return classification_result(response.text)
+
+async def classify_email_async(email_content: str, model=None) -> str:
+    """classify_email on the async Vertex AI API, for the ASGI serving mode."""
+    response = await (model or gemini_model).generate_content_async(classification_prompt(email_content))
+    return classification_result(response.text)
+
+def classification_prompt(email_content: str) -> str:
+    return (
         "You are an expert at analyzing job application emails. "
         "If the email is not job-related, return only: 'Not Job Application'.\n"
         "If it is, extract the following in this format:\n"
@@ -50,10 +73,175 @@ def classify_email(email_content: str) -> str:
         "Status: [Applied, Interviewed, Declined, Offer, or Unknown]\n\n"
         f"Email Content:\n{email_content[:4000]}"
     )
-    response = gemini_model.generate_content(prompt)
-    text = response.text.strip()
+
+def classification_result(text: str) -> str:
+    text = text.strip()
 
     if not text.lower().startswith("company:"):
         return "Not Job Application"
 
-    return text
\ No newline at end of file
+    return text
+
+def normalize_status(raw_status):
+    raw = raw_status.lower().strip()
+    if any(w in raw for w in ["declined", "rejected", "not selected"]):
+        return "Declined"
+    if any(w in raw for w in ["offer", "accepted"]):
+        return "Offer"
+    if "interview" in raw:
+        return "Interviewed"
+    return "Applied"
+
+def parse_classification_details(classification):
+    print(f"[DEBUG] Raw classification result:\n{classification}")
+    details = {"Company": "", "Job Title": "", "Location": "", "status": ""}
+    for line in classification.splitlines():
+        line = line.strip()
+        if line.lower().startswith("company:"):
+            details["Company"] = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("job title:"):
+            details["Job Title"] = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("location:"):
+            details["Location"] = line.split(":", 1)[1].strip()
+        elif line.lower().startswith("status:"):
+            details["status"] = normalize_status(line.split(":",1)[1].strip())
+    print(f"[DEBUG] Parsed classification details: {details}")
+    return details
+
+# --- Batched classification ---
+# Several truncated emails go into one request with a JSON response schema,
+# so the model returns one record per email instead of free text. Emails the
+# batch response does not cover fall back to classify_email's text format.
+
+BATCH_MAX_EMAILS = int(os.environ.get("CLASSIFY_BATCH_MAX_EMAILS", "10"))
+BATCH_EMAIL_CHARS = int(os.environ.get("CLASSIFY_BATCH_EMAIL_CHARS", "2000"))
+# The batch prompt differs from classify_email's and sees less of each email,
+# so its results are cached under their own version (see classify_payloads).
+BATCH_PROMPT_VERSION = f"{PROMPT_VERSION}/batch-{BATCH_EMAIL_CHARS}"
+BATCH_CONCURRENCY = int(os.environ.get("CLASSIFY_BATCH_CONCURRENCY", "4"))
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {
+            "index":              {"type": "integer"},
+            "is_job_application": {"type": "boolean"},
+            "company":            {"type": "string"},
+            "job_title":          {"type": "string"},
+            "location":           {"type": "string"},
+            "status": {
+                "type": "string",
+                "enum": ["Applied", "Interviewed", "Declined", "Offer", "Unknown"],
+            },
+        },
+        "required": ["index", "is_job_application"],
+    },
+}
+
+def build_batch_prompt(email_contents: list) -> str:
+    """One prompt covering every email, each tagged with its index."""
+    parts = [
+        "You are an expert at analyzing job application emails. For each email below, "
+        "return one JSON object with its index. Set is_job_application to false if the "
+        "email is not job-related; otherwise extract company, job_title, location and "
+        "status (Applied, Interviewed, Declined, Offer, or Unknown).\n"
+    ]
+    for i, content in enumerate(email_contents):
+        parts.append(f"### Email {i}\n{content[:BATCH_EMAIL_CHARS]}\n")
+    return "\n".join(parts)
+
+def parse_batch_response(text: str, count: int) -> dict:
+    """Map email index -> details dict (None when not a job application).
+
+    Details use the same keys as parse_classification_details. Indexes that
+    are missing or malformed are left out so the caller can fall back.
+    """
+    try:
+        records = json.loads(text)
+    except (TypeError, ValueError):
+        print(f"[WARN] Batch classification returned invalid JSON: {text[:200]!r}")
+        return {}
+    if not isinstance(records, list):
+        return {}
+
+    results = {}
+    for record in records:
+        if not isinstance(record, dict):
+            continue
+        index = record.get("index")
+        if not isinstance(index, int) or not 0 <= index < count or index in results:
+            continue
+        if not record.get("is_job_application"):
+            results[index] = None
+            continue
+        results[index] = {
+            "Company":   (record.get("company") or "").strip(),
+            "Job Title": (record.get("job_title") or "").strip(),
+            "Location":  (record.get("location") or "").strip(),
+            "status":    normalize_status(record.get("status") or ""),
+        }
+    return results
+
+def classify_emails_batch(email_contents: list, model=None) -> list:
+    """
+    Classify several emails with one structured-output request per chunk.
+
+    Returns one entry per email, in order: a details dict (Company, Job Title,
+    Location, status) or None if the email is not a job application. `model`
+    defaults to the Gemini model and only needs generate_content(), so a fake
+    can be passed in to run offline.
+    """
+    from vertexai.generative_models import GenerationConfig
+
+    model = model or gemini_model
+    config = GenerationConfig(response_mime_type="application/json",
+                              response_schema=BATCH_RESPONSE_SCHEMA)
+    results = []
+    for start in range(0, len(email_contents), BATCH_MAX_EMAILS):
+        chunk = email_contents[start:start + BATCH_MAX_EMAILS]
+        try:
+            response = model.generate_content(build_batch_prompt(chunk), generation_config=config)
+            parsed = parse_batch_response(response.text, len(chunk))
+        except Exception as e:
+            print(f"[WARN] Batch classification failed, falling back per email: {e}")
+            parsed = {}
+
+        for i, content in enumerate(chunk):
+            if i in parsed:
+                results.append(parsed[i])
+                continue
+            # fallback: the single-email prompt and its line-based format
+            classification = classify_email(content, model)
+            if "not job application" in classification.lower():
+                results.append(None)
+            else:
+                results.append(parse_classification_details(classification))
+    return results
+
+def format_classification(details) -> str:
+    """Inverse of parse_classification_details: classify_email's text format."""
+    if details is None:
+        return "Not Job Application"
+    return (
+        f"Company: {details['Company']}\n"
+        f"Job Title: {details['Job Title']}\n"
+        f"Location: {details['Location']}\n"
+        f"Status: {details['status']}"
+    )
+
+def classify_emails(email_contents: list, model=None) -> list:
+    """
+    classify_emails_batch with up to BATCH_CONCURRENCY chunks in flight at once.
+
+    Returns one classify_email-style string per email, so results can share the
+    classification cache (and details_from_classification) with the single path.
+    """
+    chunks = [email_contents[start:start + BATCH_MAX_EMAILS]
+              for start in range(0, len(email_contents), BATCH_MAX_EMAILS)]
+    if len(chunks) <= 1:
+        batches = [classify_emails_batch(chunk, model) for chunk in chunks]
+    else:
+        with ThreadPoolExecutor(max_workers=min(BATCH_CONCURRENCY, len(chunks))) as pool:
+            batches = list(pool.map(lambda chunk: classify_emails_batch(chunk, model), chunks))
+    return [format_classification(details) for batch in batches for details in batch]
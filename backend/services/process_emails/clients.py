@@ -0,0 +1,92 @@
+# backend/services/process_emails/clients.py
+# Purpose: Build GCP / Vertex AI clients on first use instead of at import.
+
+# Functionality: Factories are registered by name and each client is built
+# the first time something asks for it, under a per-client lock so concurrent
+# first requests share one construction. registry.proxy(name) returns a
+# stand-in object that forwards attribute access to the real client, so
+# module-level names like main.bigquery_client keep working. warm_up() can
+# build everything (and run extra hooks) on a background thread right after
+# import, letting the server start listening while clients come up.
+
+import threading
+import time
+
+
+class ClientRegistry:
+    def __init__(self):
+        self._factories   = {}
+        self._clients     = {}
+        self._locks       = {}
+        self._init_secs   = {}
+        self._lock        = threading.Lock()
+        self._warm_thread = None
+
+    def register(self, name, factory):
+        with self._lock:
+            self._factories[name] = factory
+            self._locks[name] = threading.Lock()
+
+    def get(self, name):
+        client = self._clients.get(name)
+        if client is not None:
+            return client
+        with self._locks[name]:
+            client = self._clients.get(name)
+            if client is None:
+                started = time.perf_counter()
+                client = self._factories[name]()
+                self._init_secs[name] = time.perf_counter() - started
+                self._clients[name] = client
+                print(f"[DEBUG] Initialized {name} client in {self._init_secs[name] * 1000:.0f} ms")
+        return client
+
+    def proxy(self, name):
+        return _ClientProxy(self, name)
+
+    def warm_up(self, names=None, hooks=(), background=True):
+        """Build the named clients (default: all), then run hooks; optionally on a daemon thread."""
+        names = list(names or self._factories)
+
+        def run():
+            for name in names:
+                try:
+                    self.get(name)
+                except Exception as e:
+                    # the request that needs it will retry and surface the error
+                    print(f"[WARN] Warm-up of {name} client failed: {e}")
+            for hook in hooks:
+                try:
+                    hook()
+                except Exception as e:
+                    print(f"[WARN] Warm-up hook {getattr(hook, '__name__', hook)} failed: {e}")
+
+        if not background:
+            return run()
+        self._warm_thread = threading.Thread(target=run, name="client-warm-up", daemon=True)
+        self._warm_thread.start()
+
+    def metrics(self):
+        return {
+            "initialized":     sorted(self._clients),
+            "pending":         sorted(set(self._factories) - set(self._clients)),
+            "init_ms":         {name: round(secs * 1000, 1) for name, secs in self._init_secs.items()},
+            "warm_up_running": bool(self._warm_thread and self._warm_thread.is_alive()),
+        }
+
+
+class _ClientProxy:
+    __slots__ = ("_registry", "_name")
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name     = name
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+    def __repr__(self):
+        return f"<lazy {self._name} client>"
+
+
+registry = ClientRegistry()
@@ -0,0 +1,140 @@
+# backend/services/process_emails/dedup.py
+# Purpose: Skip emails that have already been processed.
+
+# Functionality: Pub/Sub push is at-least-once and gmail_fetch can republish
+# messages around the after: boundary, so the same (user_id, email_id) can
+# arrive more than once. EmailDeduplicator answers "seen before?" from a
+# bounded in-memory LRU first and falls back to an authoritative
+# processed_emails collection in Firestore. A key is only marked processed
+# once its results are stored, so a delivery that fails halfway is still
+# retried. Duplicates arriving while the first copy is still in flight on
+# this instance are deferred rather than processed twice.
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+NEW       = "new"
+DUPLICATE = "duplicate"
+IN_FLIGHT = "in_flight"
+
+
+class DuplicateInFlight(Exception):
+    """Raised when the same email is already being processed; retry later."""
+
+
+def dedup_key(user_id, email_id):
+    # Firestore document ids cannot contain "/"
+    return f"{user_id}_{email_id}".replace("/", "_")
+
+
+class FirestoreDedupStore:
+    """Authoritative record of processed emails (pair with a TTL policy on expires_at)."""
+
+    def __init__(self, client, collection="processed_emails", ttl_days=30):
+        self.client          = client
+        self.collection_name = collection
+        self.ttl_days        = ttl_days
+
+    @property
+    def collection(self):
+        # resolved per call so constructing the store doesn't build the client
+        return self.client.collection(self.collection_name)
+
+    def exists(self, key):
+        return self.collection.document(key).get().exists
+
+    def mark(self, key, user_id, email_id):
+        from google.api_core.exceptions import AlreadyExists
+
+        now = datetime.now(timezone.utc)
+        try:
+            # create() fails if the doc exists, so the first writer wins
+            self.collection.document(key).create({
+                "user_id":      user_id,
+                "email_id":     email_id,
+                "processed_at": now,
+                "expires_at":   now + timedelta(days=self.ttl_days),
+            })
+        except AlreadyExists:
+            pass
+
+
+class EmailDeduplicator:
+    def __init__(self, store=None, max_entries=100_000):
+        self.store       = store
+        self.max_entries = max_entries
+        self._seen       = OrderedDict()
+        self._in_flight  = set()
+        self._lock       = threading.Lock()
+        self._stats = {"duplicates_skipped": 0, "memory_hits": 0, "store_hits": 0,
+                       "in_flight_deferred": 0, "store_errors": 0, "store_lookup_seconds": 0.0,
+                       "store_lookups": 0}
+
+    def _remember(self, key):
+        self._seen[key] = True
+        self._seen.move_to_end(key)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+    def claim(self, user_id, email_id):
+        """Returns NEW (caller must call finish), DUPLICATE or IN_FLIGHT."""
+        key = dedup_key(user_id, email_id)
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                self._stats["duplicates_skipped"] += 1
+                return DUPLICATE
+            if key in self._in_flight:
+                self._stats["in_flight_deferred"] += 1
+                return IN_FLIGHT
+            self._in_flight.add(key)
+
+        if self.store is not None:
+            started = time.perf_counter()
+            try:
+                seen = self.store.exists(key)
+            except Exception as e:
+                # fail open: a duplicate row is better than a dropped email
+                print(f"[WARN] Dedup store lookup failed for {key}: {e}")
+                seen = False
+                with self._lock:
+                    self._stats["store_errors"] += 1
+            with self._lock:
+                self._stats["store_lookups"] += 1
+                self._stats["store_lookup_seconds"] += time.perf_counter() - started
+                if seen:
+                    self._in_flight.discard(key)
+                    self._remember(key)
+                    self._stats["store_hits"] += 1
+                    self._stats["duplicates_skipped"] += 1
+                    return DUPLICATE
+        return NEW
+
+    def finish(self, user_id, email_id, processed):
+        """Release a NEW claim; processed=True records the email as done."""
+        key = dedup_key(user_id, email_id)
+        if processed and self.store is not None:
+            try:
+                self.store.mark(key, user_id, email_id)
+            except Exception as e:
+                print(f"[WARN] Dedup store write failed for {key}: {e}")
+                with self._lock:
+                    self._stats["store_errors"] += 1
+        with self._lock:
+            self._in_flight.discard(key)
+            if processed:
+                self._remember(key)
+
+    def metrics(self):
+        with self._lock:
+            s = dict(self._stats)
+            size, in_flight = len(self._seen), len(self._in_flight)
+        lookups = s.pop("store_lookups")
+        lookup_secs = s.pop("store_lookup_seconds")
+        s["avg_store_lookup_ms"] = round(lookup_secs * 1000 / lookups, 1) if lookups else 0.0
+        s["memory_entries"] = size
+        s["in_flight"] = in_flight
+        return s
@@ -0,0 +1,72 @@
+# backend/services/process_emails/firestore_writer.py
+# Purpose: Write job_application documents to Firestore in batches.
+
+# Functionality: BufferedFirestoreWriter groups users/{uid}/job_applications
+# writes from concurrent requests into WriteBatch commits of up to 500
+# operations (Firestore's per-batch limit), flushing by count or age. A batch
+# commit is atomic, so when one fails its documents are retried one by one
+# and every document that still fails is reported back to its caller.
+
+import time
+
+from write_buffer import GroupCommitBuffer
+
+MAX_BATCH_OPS = 500
+
+
+class BufferedFirestoreWriter(GroupCommitBuffer):
+    """Items are (user_id, email_id, data) tuples."""
+
+    name = "Firestore writer"
+
+    def __init__(self, client, max_docs=MAX_BATCH_OPS, max_age_secs=0.05, max_retries=3):
+        self.client      = client
+        self.max_retries = max_retries
+        self.doc_retries = 0
+        super().__init__(min(max_docs, MAX_BATCH_OPS), max_age_secs)
+
+    def _ref(self, user_id, email_id):
+        return (self.client
+            .collection('users')
+            .document(user_id)
+            .collection('job_applications')
+            .document(email_id))
+
+    def _set_with_retry(self, user_id, email_id, data):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._ref(user_id, email_id).set(data)
+                return None
+            except Exception as e:
+                if attempt == self.max_retries:
+                    return e
+                self.doc_retries += 1
+                time.sleep(min(0.2 * 2 ** attempt, 2))
+
+    def _write(self, docs):
+        errors = {}
+        for start in range(0, len(docs), MAX_BATCH_OPS):
+            chunk = docs[start:start + MAX_BATCH_OPS]
+            batch = self.client.batch()
+            for user_id, email_id, data in chunk:
+                batch.set(self._ref(user_id, email_id), data)
+            try:
+                batch.commit()
+                continue
+            except Exception as e:
+                print(f"[WARN] Firestore batch of {len(chunk)} failed ({e}), retrying per document")
+
+            for offset, (user_id, email_id, data) in enumerate(chunk):
+                error = self._set_with_retry(user_id, email_id, data)
+                if error is not None:
+                    print(f"[ERROR] Firestore save failed for email {email_id}, user {user_id}: {error}")
+                    errors[start + offset] = error
+        return errors
+
+    def write(self, docs, timeout=None):
+        """Queue docs and block until committed; returns {email_id: error} for failures."""
+        errors = self.submit(docs).result(timeout=timeout)
+        return {docs[i][1]: error for i, error in errors.items()}
+
+    def metrics(self):
+        return {**super().metrics(), "doc_retries": self.doc_retries}
@@ -4,13 +4,28 @@ import os
 import json
 import base64
 import uuid
+import asyncio
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from flask import Flask, request
 from google.cloud import bigquery, firestore, pubsub_v1
 from google.cloud.exceptions import NotFound
 
 from config import PROJECT_ID, LOCATION
-from classifier_logic import is_job_application, classify_email
+from classifier_logic import (is_job_application, classify_email, classify_email_async,
+                              classify_emails, parse_classification_details, PROMPT_VERSION,
+                              BATCH_PROMPT_VERSION, BATCH_EMAIL_CHARS)
+from classification_cache import ClassificationCache, FirestoreCacheStore, SQLiteCacheStore
+from prefilter import prefilter_email
+from bq_writer import BufferedBigQueryWriter, StorageWriteBackend
+from firestore_writer import BufferedFirestoreWriter
+from raw_archive import RawContentArchive, content_hash
+from asgi_app import create_asgi_app
+from clients import registry
+from dedup import (EmailDeduplicator, FirestoreDedupStore, DuplicateInFlight,
+                   DUPLICATE, IN_FLIGHT)
 
 def get_env(var_name, default_value):
     val = os.environ.get(var_name, default_value)
@@ -23,47 +38,56 @@ BQ_DATASET_ID      = get_env("BQ_DATASET_ID",      "user_data")
 BQ_RAW_TABLE_ID    = get_env("BQ_RAW_TABLE_ID",    "job_applications")
 FIRESTORE_DB_ID    = get_env("FIRESTORE_DATABASE_ID", "emails-firestore")
 PUBSUB_TOPIC       = get_env("PUBSUB_TOPIC",       "applications-ready-topic")
+PREFILTER_ENABLED  = get_env("PREFILTER_ENABLED",  "true").lower() == "true"
+CACHE_STORE        = get_env("CLASSIFY_CACHE_STORE", "firestore")   # firestore | sqlite | none
+CACHE_SIZE         = int(get_env("CLASSIFY_CACHE_SIZE", "10000"))
+CACHE_TTL_SECS     = int(get_env("CLASSIFY_CACHE_TTL_SECS", str(7 * 24 * 3600)))
+BQ_WRITE_MODE      = get_env("BQ_WRITE_MODE",      "storage")        # storage | legacy
+BQ_FLUSH_MAX_ROWS  = int(get_env("BQ_FLUSH_MAX_ROWS", "500"))
+# Under push each request waits for its flush, and with --threads 8 the row
+# cap is never reached, so the age is what every email pays: keep it short.
+BQ_FLUSH_MAX_AGE_SECS = float(get_env("BQ_FLUSH_MAX_AGE_SECS", "0.05"))
+FS_FLUSH_MAX_DOCS  = int(get_env("FIRESTORE_FLUSH_MAX_DOCS", "500"))       # WriteBatch caps at 500
+FS_FLUSH_MAX_AGE_SECS = float(get_env("FIRESTORE_FLUSH_MAX_AGE_SECS", "0.05"))
+RAW_CONTENT_MODE   = get_env("RAW_CONTENT_MODE",   "archive")        # archive | inline
+BQ_ARCHIVE_TABLE_ID = get_env("BQ_ARCHIVE_TABLE_ID", "raw_email_archive")
+RAW_SNIPPET_CHARS  = int(get_env("RAW_SNIPPET_CHARS", "500"))
+ASGI_BLOCKING_WORKERS = int(get_env("ASGI_BLOCKING_WORKERS", "64"))  # threads for Firestore/BigQuery calls
+DEDUP_STORE        = get_env("DEDUP_STORE",        "firestore")      # firestore | memory | none
+DEDUP_LRU_SIZE     = int(get_env("DEDUP_LRU_SIZE", "100000"))
+CLIENT_WARMUP      = get_env("CLIENT_WARMUP",      "background")     # background | eager | off
+BATCH_SCREEN_WORKERS = int(get_env("BATCH_SCREEN_WORKERS", "16"))   # dedup/prefilter threads per pull batch
 
-print(f"[DEBUG] Initializing BigQuery client for project: {PROJECT_ID}")
-bigquery_client = bigquery.Client(project=PROJECT_ID)
+# Clients are built on first use (or by the warm-up at the bottom of this
+# file), so a cold start can serve before every connection is up.
+registry.register("bigquery",  lambda: bigquery.Client(project=PROJECT_ID))
+registry.register("firestore", lambda: firestore.Client(project=PROJECT_ID, database=FIRESTORE_DB_ID))
+registry.register("publisher", pubsub_v1.PublisherClient)
+bigquery_client  = registry.proxy("bigquery")
+firestore_client = registry.proxy("firestore")
+publisher        = registry.proxy("publisher")
+topic_path       = f"projects/{PROJECT_ID}/topics/{PUBSUB_TOPIC}"
 
-print(f"[DEBUG] Initializing Firestore client for project: {PROJECT_ID}, database: {FIRESTORE_DB_ID}")
-firestore_client = firestore.Client(project=PROJECT_ID, database=FIRESTORE_DB_ID)
+if CACHE_STORE == "firestore":
+    cache_store = FirestoreCacheStore(firestore_client)
+elif CACHE_STORE == "sqlite":
+    cache_store = SQLiteCacheStore(get_env("CLASSIFY_CACHE_PATH", "classification_cache.db"))
+else:
+    cache_store = None
+classification_cache = ClassificationCache(PROMPT_VERSION, cache_store,
+                                           max_entries=CACHE_SIZE, ttl_secs=CACHE_TTL_SECS)
 
-print(f"[DEBUG] Initializing Pub/Sub publisher for topic: {PUBSUB_TOPIC}")
-publisher    = pubsub_v1.PublisherClient()
-topic_path   = publisher.topic_path(PROJECT_ID, PUBSUB_TOPIC)
+if DEDUP_STORE == "none":
+    deduplicator = None
+else:
+    deduplicator = EmailDeduplicator(
+        FirestoreDedupStore(firestore_client) if DEDUP_STORE == "firestore" else None,
+        max_entries=DEDUP_LRU_SIZE)
 
 app = Flask(__name__)
-app.debug = True
+app.debug = get_env("FLASK_DEBUG", "false").lower() == "true"   # never on in production
 app.config["PROPAGATE_EXCEPTIONS"] = True
 
-def normalize_status(raw_status):
-    raw = raw_status.lower().strip()
-    if any(w in raw for w in ["declined", "rejected", "not selected"]):
-        return "Declined"
-    if any(w in raw for w in ["offer", "accepted"]):
-        return "Offer"
-    if "interview" in raw:
-        return "Interviewed"
-    return "Applied"
-
-def parse_classification_details(classification):
-    print(f"[DEBUG] Raw classification result:\n{classification}")
-    details = {"Company": "", "Job Title": "", "Location": "", "status": ""}
-    for line in classification.splitlines():
-        line = line.strip()
-        if line.lower().startswith("company:"):
-            details["Company"] = line.split(":", 1)[1].strip()
-        elif line.lower().startswith("job title:"):
-            details["Job Title"] = line.split(":", 1)[1].strip()
-        elif line.lower().startswith("location:"):
-            details["Location"] = line.split(":", 1)[1].strip()
-        elif line.lower().startswith("status:"):
-            details["status"] = normalize_status(line.split(":",1)[1].strip())
-    print(f"[DEBUG] Parsed classification details: {details}")
-    return details
-
 def normalize_email_date(email_date):
     if isinstance(email_date, int) and email_date > 1_000_000_000_000:
         try:
@@ -74,101 +98,334 @@ def normalize_email_date(email_date):
         return email_date
     return datetime.utcnow().isoformat()
 
-def save_results_to_bigquery(rows):
-    dataset_ref = bigquery_client.dataset(BQ_DATASET_ID)
-    table_ref   = dataset_ref.table(BQ_RAW_TABLE_ID)
+# Columns of the raw table. New fields appended here are added to an existing
+# table by ensure_bigquery_schema (BigQuery only allows additive NULLABLE changes).
+BQ_SCHEMA = [
+    bigquery.SchemaField("user_id",           "STRING"),
+    bigquery.SchemaField("email_id",          "STRING"),
+    bigquery.SchemaField("company",           "STRING"),
+    bigquery.SchemaField("job_title",         "STRING"),
+    bigquery.SchemaField("location",          "STRING"),
+    bigquery.SchemaField("status",            "STRING"),
+    bigquery.SchemaField("inserted_at",       "TIMESTAMP"),
+    bigquery.SchemaField("email_date",        "TIMESTAMP"),
+    bigquery.SchemaField("raw_email_content", "STRING"),   # only filled in RAW_CONTENT_MODE=inline
+    bigquery.SchemaField("content_hash",      "STRING"),
+    bigquery.SchemaField("raw_email_snippet", "STRING"),
+]
+
+# One row per distinct email body, keyed by content_hash (see raw_archive.py).
+ARCHIVE_SCHEMA = [
+    bigquery.SchemaField("content_hash",       "STRING"),
+    bigquery.SchemaField("codec",              "STRING"),
+    bigquery.SchemaField("compressed_content", "BYTES"),
+    bigquery.SchemaField("original_bytes",     "INTEGER"),
+    bigquery.SchemaField("compressed_bytes",   "INTEGER"),
+    bigquery.SchemaField("archived_at",        "TIMESTAMP"),
+]
+
+_bq_schema_ready = False
+_bq_schema_lock  = threading.Lock()
 
-    # 1) Ensure dataset exists
+def _ensure_table(dataset_ref, table_id, schema):
+    table_ref = dataset_ref.table(table_id)
     try:
-        bigquery_client.get_dataset(dataset_ref)
+        table = bigquery_client.get_table(table_ref)
     except NotFound:
-        print(f"[DEBUG] Dataset {BQ_DATASET_ID} not found, creating it…")
-        ds = bigquery.Dataset(dataset_ref)
-        ds.location = LOCATION
-        bigquery_client.create_dataset(ds)
-        print(f"[DEBUG] Created dataset {BQ_DATASET_ID} in {LOCATION}")
+        print(f"[DEBUG] Table {table_id} not found, creating it…")
+        bigquery_client.create_table(bigquery.Table(table_ref, schema=schema))
+        print(f"[DEBUG] Created table {BQ_DATASET_ID}.{table_id}")
+        return
+    existing = {field.name for field in table.schema}
+    missing  = [field for field in schema if field.name not in existing]
+    if missing:
+        table.schema = list(table.schema) + missing
+        bigquery_client.update_table(table, ["schema"])
+        print(f"[DEBUG] Added columns {[f.name for f in missing]} to {BQ_DATASET_ID}.{table_id}")
+
+def ensure_bigquery_schema(force=False):
+    """Make sure the dataset and tables exist with every schema column.
+
+    Runs once per process (on the first write); later calls return
+    immediately unless force=True, which save_results_to_bigquery uses after
+    an insert fails with NotFound.
+    """
+    global _bq_schema_ready
+    if _bq_schema_ready and not force:
+        return
+    with _bq_schema_lock:
+        if _bq_schema_ready and not force:
+            return
+
+        dataset_ref = bigquery_client.dataset(BQ_DATASET_ID)
 
-    # 2) Ensure table exists
+        # 1) Ensure dataset exists
+        try:
+            bigquery_client.get_dataset(dataset_ref)
+        except NotFound:
+            print(f"[DEBUG] Dataset {BQ_DATASET_ID} not found, creating it…")
+            ds = bigquery.Dataset(dataset_ref)
+            ds.location = LOCATION
+            bigquery_client.create_dataset(ds)
+            print(f"[DEBUG] Created dataset {BQ_DATASET_ID} in {LOCATION}")
+
+        # 2) Ensure tables exist and have every column we write
+        _ensure_table(dataset_ref, BQ_RAW_TABLE_ID, BQ_SCHEMA)
+        if RAW_CONTENT_MODE == "archive":
+            _ensure_table(dataset_ref, BQ_ARCHIVE_TABLE_ID, ARCHIVE_SCHEMA)
+
+        _bq_schema_ready = True
+
+def insert_rows_legacy(rows):
+    """Streaming insert with insertId = email_id so retried rows are de-duplicated."""
+    ensure_bigquery_schema()
+    table_ref = bigquery_client.dataset(BQ_DATASET_ID).table(BQ_RAW_TABLE_ID)
+    row_ids   = [row.get("email_id") for row in rows]
     try:
-        bigquery_client.get_table(table_ref)
+        return bigquery_client.insert_rows_json(table_ref, rows, row_ids=row_ids)
     except NotFound:
-        print(f"[DEBUG] Table {BQ_RAW_TABLE_ID} not found, creating it…")
-        schema = [
-            bigquery.SchemaField("user_id",           "STRING"),
-            bigquery.SchemaField("email_id",          "STRING"),
-            bigquery.SchemaField("company",           "STRING"),
-            bigquery.SchemaField("job_title",         "STRING"),
-            bigquery.SchemaField("location",          "STRING"),
-            bigquery.SchemaField("status",            "STRING"),
-            bigquery.SchemaField("inserted_at",       "TIMESTAMP"),
-            bigquery.SchemaField("email_date",        "TIMESTAMP"),
-            bigquery.SchemaField("raw_email_content", "STRING"),
-        ]
-        table = bigquery.Table(table_ref, schema=schema)
-        bigquery_client.create_table(table)
-        print(f"[DEBUG] Created table {BQ_DATASET_ID}.{BQ_RAW_TABLE_ID}")
-
-    # 3) Insert
-    print(f"[DEBUG] Inserting {len(rows)} rows into {BQ_DATASET_ID}.{BQ_RAW_TABLE_ID}")
-    errors = bigquery_client.insert_rows_json(table_ref, rows)
+        # dataset/table dropped since we cached the check: rebuild and retry once
+        print(f"[WARN] {BQ_DATASET_ID}.{BQ_RAW_TABLE_ID} not found on insert, re-ensuring schema")
+        ensure_bigquery_schema(force=True)
+        return bigquery_client.insert_rows_json(table_ref, rows, row_ids=row_ids)
+
+def _build_bq_writer():
+    primary = insert_rows_legacy
+    if BQ_WRITE_MODE == "storage":
+        try:
+            storage = StorageWriteBackend(PROJECT_ID, BQ_DATASET_ID, BQ_RAW_TABLE_ID, BQ_SCHEMA)
+            def primary(rows):
+                ensure_bigquery_schema()
+                return storage.write(rows)
+            atexit.register(storage.close)
+        except ImportError as e:
+            print(f"[WARN] Storage Write API unavailable ({e}), using streaming inserts")
+    return BufferedBigQueryWriter(primary, insert_rows_legacy,
+                                  max_rows=BQ_FLUSH_MAX_ROWS, max_age_secs=BQ_FLUSH_MAX_AGE_SECS)
+
+bq_writer = _build_bq_writer()
+# registered after storage.close, so atexit runs it first: drain, then finalize
+atexit.register(bq_writer.drain)
+
+def insert_archive_rows(rows):
+    """Streaming insert into the archive table with insertId = content_hash."""
+    ensure_bigquery_schema()
+    table_ref = bigquery_client.dataset(BQ_DATASET_ID).table(BQ_ARCHIVE_TABLE_ID)
+    return bigquery_client.insert_rows_json(table_ref, rows, row_ids=[r["content_hash"] for r in rows])
+
+archive_writer = BufferedBigQueryWriter(insert_archive_rows, None, max_rows=BQ_FLUSH_MAX_ROWS,
+                                        max_age_secs=BQ_FLUSH_MAX_AGE_SECS, name="Archive writer")
+atexit.register(archive_writer.drain)
+raw_archive = RawContentArchive(archive_writer.write)
+
+def archive_raw_content(rows):
+    """Move raw_email_content out of fact rows into the archive table.
+
+    Returns (rows to write, errors for rows whose body could not be archived);
+    those rows are held back so the message is retried instead of losing the body.
+    """
+    rows = [dict(row) for row in rows]
+    items = [(row["content_hash"], row.pop("raw_email_content", None) or "") for row in rows]
+    try:
+        failed = raw_archive.store(items)
+    except Exception as e:
+        print(f"[ERROR] Archiving {len(rows)} email bodies failed: {e}")
+        failed = {i: [{"reason": "archive", "message": str(e)}] for i in range(len(rows))}
+    return rows, failed
+
+def save_results_to_bigquery(rows):
+    """Buffer rows for the next bulk flush and wait until it lands; returns insert errors."""
+    print(f"[DEBUG] Queueing {len(rows)} rows for {BQ_DATASET_ID}.{BQ_RAW_TABLE_ID}")
+    if RAW_CONTENT_MODE == "archive":
+        rows, archive_failed = archive_raw_content(rows)
+        keep = [i for i in range(len(rows)) if i not in archive_failed]
+        errors = [{"index": keep[err["index"]], "errors": err["errors"]}
+                  for err in bq_writer.write([rows[i] for i in keep])]
+        errors += [{"index": i, "errors": e} for i, e in archive_failed.items()]
+    else:
+        errors = bq_writer.write(rows)
     if errors:
         print("[ERROR] BigQuery insert errors:", errors)
     else:
         print(f"✅ Inserted {len(rows)} rows to BigQuery")
+    return errors
+
+fs_writer = BufferedFirestoreWriter(firestore_client, max_docs=FS_FLUSH_MAX_DOCS,
+                                    max_age_secs=FS_FLUSH_MAX_AGE_SECS)
+atexit.register(fs_writer.drain)
 
 def save_results_to_firestore(data_dict, user_id, email_id):
+    """Returns the failed email_ids (empty once the doc is committed)."""
     print(f"[DEBUG] Saving to Firestore for user {user_id}, email {email_id}")
-    try:
-        (firestore_client
-            .collection('users')
-            .document(user_id)
-            .collection('job_applications')
-            .document(email_id)
-            .set(data_dict)
-        )
+    failed = save_many_to_firestore([(user_id, email_id, data_dict)])
+    if not failed:
         print(f"✅ Saved email {email_id} for user {user_id} to Firestore.")
+    return failed
+
+def save_many_to_firestore(docs):
+    """Queue (user_id, email_id, data) tuples for the next batched commit; returns failed email_ids."""
+    try:
+        errors = fs_writer.submit(docs).result()
     except Exception as e:
-        print(f"[ERROR] Firestore save failed for email {email_id}, user {user_id}: {e}")
+        print(f"[ERROR] Firestore batch save failed for {len(docs)} emails: {e}")
+        return {email_id for _, email_id, _ in docs}
+    if not errors:
+        if docs:
+            print(f"✅ Saved {len(docs)} emails to Firestore.")
+        return set()
+    return {docs[i][1] for i in errors}
 
-@app.route('/', methods=['POST'])
-def index():
-    print("[DEBUG] Received request")
-    envelope = request.get_json(silent=True)
-    if not envelope or 'message' not in envelope:
-        print("[ERROR] Invalid Pub/Sub message.")
-        return 'Invalid Pub/Sub message', 400
+def claim_payload(payload):
+    """Take the dedup claim for a payload; returns a skip reason if it was already processed.
 
-    message = envelope['message']
-    if 'data' not in message:
-        print("[ERROR] No data in Pub/Sub message.")
-        return 'No data in message', 400
+    Raises DuplicateInFlight if the same email is still being processed.
+    """
+    user_id  = payload['user_id']
+    email_id = payload['email_id']
+    if deduplicator is None:
+        return None
+    claim = deduplicator.claim(user_id, email_id)
+    if claim == DUPLICATE:
+        print(f"[DEBUG] Email {email_id} for user {user_id} already processed, skipping.")
+        return 'Duplicate email skipped'
+    if claim == IN_FLIGHT:
+        raise DuplicateInFlight(f"email {email_id} for user {user_id} is already in flight")
+    return None
+
+def finish_email(user_id, email_id, processed):
+    """Release the dedup claim taken by classify_payload."""
+    if deduplicator is not None:
+        deduplicator.finish(user_id, email_id, processed)
+
+def classify_payload(payload):
+    """Dedup + prefilter + cached Gemini classification for one decoded email payload.
 
+    Returns (details, reason): details is None when the email is not a job
+    application or was already processed, with reason saying why it was
+    skipped. When details is returned the caller must call finish_email once
+    the results are stored. Raises DuplicateInFlight if the same email is
+    still being processed.
+    """
+    skip_reason = claim_payload(payload)
+    if skip_reason:
+        return None, skip_reason
     try:
-        pubsub_data   = base64.b64decode(message['data']).decode()
-        print(f"[DEBUG] Decoded Pub/Sub data:\n{pubsub_data}")
-        payload       = json.loads(pubsub_data)
-        email_content = payload.get('email_content')
-        user_id       = payload.get('user_id')
+        skip_reason = prefilter_payload(payload)
+        if skip_reason:
+            details = None
+        else:
+            classification = classification_cache.get_or_classify(payload['email_content'], classify_email)
+            details, skip_reason = details_from_classification(classification, payload['email_id'])
+    except Exception:
+        finish_email(payload['user_id'], payload['email_id'], processed=False)
+        raise
+    if details is None:
+        finish_email(payload['user_id'], payload['email_id'], processed=True)
+    return details, skip_reason
+
+async def classify_payload_async(payload):
+    """classify_payload for the ASGI app: awaits Gemini instead of blocking a thread."""
+    skip_reason = await asyncio.to_thread(claim_payload, payload)
+    if skip_reason:
+        return None, skip_reason
+    try:
+        skip_reason = prefilter_payload(payload)
+        if skip_reason:
+            details = None
+        else:
+            classification = await classification_cache.get_or_classify_async(
+                payload['email_content'], classify_email_async)
+            details, skip_reason = details_from_classification(classification, payload['email_id'])
+    except Exception:
+        await asyncio.to_thread(finish_email, payload['user_id'], payload['email_id'], False)
+        raise
+    if details is None:
+        await asyncio.to_thread(finish_email, payload['user_id'], payload['email_id'], True)
+    return details, skip_reason
+
+def classify_payloads(payloads):
+    """classify_payload for a pull batch: the cache misses go to Gemini as batched requests.
+
+    Returns one (details, reason) per payload, in order; details is the
+    exception instead when that payload could not be classified (e.g.
+    DuplicateInFlight), and the caller should nack it. finish_email rules are
+    the same as for classify_payload.
+    """
+    def screen(payload):
+        """Claim + prefilter; returns a skip reason, or the exception to nack with."""
+        try:
+            skip_reason = claim_payload(payload)
+        except Exception as e:
+            return e
+        if skip_reason:
+            return skip_reason
+        try:
+            skip_reason = prefilter_payload(payload)
+        except Exception as e:
+            finish_email(payload['user_id'], payload['email_id'], processed=False)
+            return e
+        if skip_reason:
+            finish_email(payload['user_id'], payload['email_id'], processed=True)
+        return skip_reason
+
+    results = [None] * len(payloads)
+    pending = []
+    # dedup claims are a store round trip each, so screen the batch concurrently
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_SCREEN_WORKERS, len(payloads)))) as pool:
+        screened = list(pool.map(screen, payloads))
+    for i, outcome in enumerate(screened):
+        if isinstance(outcome, Exception):
+            results[i] = (outcome, None)
+        elif outcome:
+            results[i] = (None, outcome)
+        else:
+            pending.append(i)
+    if not pending:
+        return results
+
+    try:
+        classifications = classification_cache.get_or_classify_many(
+            [payloads[i]['email_content'] for i in pending], classify_emails,
+            prompt_version=BATCH_PROMPT_VERSION, max_chars=BATCH_EMAIL_CHARS)
     except Exception as e:
-        print(f"[ERROR] JSON decoding error: {e}")
-        return 'Invalid JSON payload', 400
+        print(f"[ERROR] Batch classification of {len(pending)} emails failed: {e}")
+        for i in pending:
+            finish_email(payloads[i]['user_id'], payloads[i]['email_id'], processed=False)
+            results[i] = (e, None)
+        return results
 
-    if not email_content or not user_id:
-        print("[ERROR] Missing email_content or user_id.")
-        return 'Missing email_content or user_id', 400
+    for i, classification in zip(pending, classifications):
+        payload = payloads[i]
+        details, skip_reason = details_from_classification(classification, payload['email_id'])
+        if details is None:
+            finish_email(payload['user_id'], payload['email_id'], processed=True)
+        results[i] = (details, skip_reason)
+    return results
 
-    email_id = payload.get('email_id', f"local-{uuid.uuid4()}")
-    print(f"[DEBUG] Processing email for user: {user_id}, email_id: {email_id}")
+def prefilter_payload(payload):
+    """Returns a skip reason if the prefilter rejects the email."""
+    if not PREFILTER_ENABLED:
+        return None
+    screen = prefilter_email(payload['email_content'], payload.get("from", ""),
+                             payload.get("subject", ""), payload.get("headers"))
+    print(f"[DEBUG] Prefilter for {payload['email_id']}: {screen.decision} (score={screen.score}, {screen.reasons})")
+    if screen.decision == "reject":
+        return 'Email rejected by prefilter'
+    return None
 
-    classification = classify_email(email_content)
+def details_from_classification(classification, email_id):
     if "not job application" in classification.lower():
         print(f"[DEBUG] Email {email_id} skipped (not job application).")
-        return 'Email classified as not job application', 200
+        return None, 'Email classified as not job application'
+    return parse_classification_details(classification), None
 
-    details = parse_classification_details(classification)
+def build_records(payload, details):
+    """BigQuery row and Firestore document for a classified job email."""
+    email_content = payload['email_content']
+    details = dict(details)
     details.update({
-        "email_id":   email_id,
-        "user_id":    user_id,
+        "email_id":   payload['email_id'],
+        "user_id":    payload['user_id'],
         "inserted_at": datetime.utcnow().isoformat(),
         "email_date": normalize_email_date(payload.get("email_date")),
     })
@@ -182,9 +439,10 @@ def index():
         "status":            details["status"],
         "inserted_at":       details["inserted_at"],
         "email_date":        details["email_date"],
-        "raw_email_content": email_content,
+        "raw_email_content": email_content,   # moved to the archive table in archive mode
+        "content_hash":      content_hash(email_content),
+        "raw_email_snippet": email_content[:RAW_SNIPPET_CHARS],
     }
-    save_results_to_bigquery([bq_row])
 
     firestore_data = {
         "company":                details["Company"],
@@ -195,22 +453,140 @@ def index():
         "email_date":             details["email_date"],
         "raw_email_content_snippet": email_content[:500],
     }
-    save_results_to_firestore(firestore_data, user_id, email_id)
+    return bq_row, firestore_data
 
+def publish_batch_ready(email_ids):
+    """Tell downstream (dbt trigger) that new application rows are available."""
     batch_event = {
         "batch_id":  str(uuid.uuid4()),
         "timestamp": datetime.utcnow().isoformat(),
-        "email_id":  email_id
+        "email_id":  email_ids[0] if len(email_ids) == 1 else None,
+        "email_ids": email_ids,
     }
     publisher.publish(
         topic_path,
         json.dumps(batch_event).encode(),
         content_type="batch-ready"
     )
-    print(f"[DEBUG] Published batch-ready event for email_id={email_id}")
+    print(f"[DEBUG] Published batch-ready event for email_ids={email_ids}")
+
+def decode_push_envelope(envelope):
+    """Pub/Sub push envelope -> (payload, None), or (None, (error message, status))."""
+    if not envelope or 'message' not in envelope:
+        print("[ERROR] Invalid Pub/Sub message.")
+        return None, ('Invalid Pub/Sub message', 400)
+
+    message = envelope['message']
+    if 'data' not in message:
+        print("[ERROR] No data in Pub/Sub message.")
+        return None, ('No data in message', 400)
+
+    try:
+        pubsub_data   = base64.b64decode(message['data']).decode()
+        print(f"[DEBUG] Decoded Pub/Sub data:\n{pubsub_data}")
+        payload       = json.loads(pubsub_data)
+        email_content = payload.get('email_content')
+        user_id       = payload.get('user_id')
+    except Exception as e:
+        print(f"[ERROR] JSON decoding error: {e}")
+        return None, ('Invalid JSON payload', 400)
 
+    if not email_content or not user_id:
+        print("[ERROR] Missing email_content or user_id.")
+        return None, ('Missing email_content or user_id', 400)
+
+    email_id = payload.setdefault('email_id', f"local-{uuid.uuid4()}")
+    print(f"[DEBUG] Processing email for user: {user_id}, email_id: {email_id}")
+    return payload, None
+
+def store_results(payload, details):
+    """Write a classified job email to BigQuery and Firestore, then announce it.
+
+    Returns False if the BigQuery row or the Firestore doc was not stored;
+    the caller must then answer non-2xx so Pub/Sub redelivers the message.
+    Firestore goes first: its set() is idempotent, while a Storage Write API
+    append has no insertId, so the fact row is only appended once nothing
+    else can send the message back for another attempt.
+    """
+    user_id, email_id = payload['user_id'], payload['email_id']
+    try:
+        bq_row, firestore_data = build_records(payload, details)
+        fs_failed = save_results_to_firestore(firestore_data, user_id, email_id)
+        bq_errors = [] if fs_failed else save_results_to_bigquery([bq_row])
+    except Exception:
+        finish_email(user_id, email_id, processed=False)
+        raise
+    stored = not bq_errors and not fs_failed
+    finish_email(user_id, email_id, processed=stored)
+    if not stored:
+        return False
+    publish_batch_ready([email_id])
+    return True
+
+@app.route('/', methods=['POST'])
+def index():
+    print("[DEBUG] Received request")
+    payload, error = decode_push_envelope(request.get_json(silent=True))
+    if error:
+        return error
+
+    try:
+        details, skip_reason = classify_payload(payload)
+    except DuplicateInFlight as e:
+        # non-2xx makes Pub/Sub redeliver after the first copy has finished
+        print(f"[WARN] {e}")
+        return 'Duplicate email in flight', 409
+    if details is None:
+        return skip_reason, 200
+
+    if not store_results(payload, details):
+        return 'Failed to store results', 500
+    return 'Email processed successfully', 200
+
+async def index_async(envelope):
+    """ASGI version of index(): the Gemini call is awaited and storage runs in the thread pool."""
+    payload, error = decode_push_envelope(envelope)
+    if error:
+        return error
+
+    try:
+        details, skip_reason = await classify_payload_async(payload)
+    except DuplicateInFlight as e:
+        print(f"[WARN] {e}")
+        return 'Duplicate email in flight', 409
+    if details is None:
+        return skip_reason, 200
+
+    # writes block on the shared group-commit flushes, not on their own round trips
+    if not await asyncio.to_thread(store_results, payload, details):
+        return 'Failed to store results', 500
     return 'Email processed successfully', 200
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return collect_metrics(), 200
+
+def collect_metrics():
+    return {
+        "classification_cache": classification_cache.metrics(),
+        "bigquery_writer":      bq_writer.metrics(),
+        "raw_archive":          {**raw_archive.metrics(), "writer": archive_writer.metrics()},
+        "firestore_writer":     fs_writer.metrics(),
+        "dedup":                deduplicator.metrics() if deduplicator else None,
+        "clients":              registry.metrics(),
+    }
+
+# ASGI entry point (SERVING_MODE=asgi in the Dockerfile): same pipeline, one
+# event loop instead of one blocked thread per in-flight Gemini call.
+asgi_app = create_asgi_app({
+    ("POST", "/"):        index_async,
+    ("GET",  "/metrics"): lambda _: (collect_metrics(), 200),
+}, blocking_workers=ASGI_BLOCKING_WORKERS)
+
+if CLIENT_WARMUP != "off":
+    # schema check included so the first write doesn't pay for it either
+    registry.warm_up(hooks=[ensure_bigquery_schema], background=CLIENT_WARMUP == "background")
+
 if __name__ == '__main__':
     print("[DEBUG] Running Cloud Run service locally.")
-    app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
+    app.run(debug=app.debug, host='0.0.0.0', port=int(os.environ.get('PORT', 8080)))
@@ -0,0 +1,185 @@
+# backend/services/process_emails/prefilter.py
+# Purpose: Cheap local screening that runs before the Gemini call.
+
+# Functionality: Scores an email from its sender domain, ATS (applicant tracking
+# system) signatures and keywords. Mail that is clearly not job-related
+# (newsletters, receipts, promotions) is rejected locally; anything job-like or
+# ambiguous still goes to classify_email, which does the actual extraction.
+# Bulk-sender domains only lower the score: the same companies also hire, so
+# their recruiting mail can still get through.
+# Run `python prefilter.py fixtures/prefilter_labeled.jsonl` to report
+# precision, recall and LLM-call savings on a labeled fixture set.
+
+import json
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+
+# Domains that send application confirmations, interview invites, etc.
+ATS_DOMAINS = {
+    "greenhouse.io", "greenhouse-mail.io", "lever.co", "hire.lever.co", "myworkday.com",
+    "myworkdayjobs.com", "icims.com", "smartrecruiters.com", "ashbyhq.com", "jobvite.com",
+    "taleo.net", "successfactors.com", "workablemail.com", "bamboohr.com", "breezy.hr",
+    "recruitee.com", "jazzhr.com", "applytojob.com",
+}
+
+# Job boards send application confirmations and job-alert digests from the
+# same domains, so they only nudge the keyword score instead of bypassing it.
+JOB_BOARD_DOMAINS = {"linkedin.com": 1, "indeed.com": 1}
+
+# Headers written by people rather than mail software; ATS signatures are not
+# looked for in them (a subject can mention "Workday" without an ATS sending it).
+FREE_TEXT_HEADERS = {"subject", "date"}
+
+# Bulk senders: most of their mail is receipts and marketing, but their
+# recruiting teams mail from the same domains, so this is a penalty, not a veto.
+DEFAULT_DENY_DOMAINS = {
+    "amazon.com", "ebay.com", "paypal.com", "uber.com", "doordash.com", "spotify.com",
+    "netflix.com", "substack.com", "mailchimp.com", "medium.com", "groupon.com",
+}
+
+# Header/body fragments left by common ATS mailers.
+ATS_SIGNATURES = [
+    "greenhouse", "lever.co", "workday", "icims", "smartrecruiters", "ashby",
+    "jobvite", "taleo", "successfactors", "workable",
+]
+
+POSITIVE_KEYWORDS = {
+    "thank you for applying": 4, "your application": 3, "application received": 3,
+    "we received your application": 4, "interview": 3, "recruiter": 2, "hiring manager": 2,
+    "position": 1, "role": 1, "candidate": 2, "candidacy": 3, "offer letter": 4,
+    "unfortunately": 1, "move forward": 2, "next steps": 1, "job": 1, "applied": 2,
+    "assessment": 2, "phone screen": 3, "onsite": 2,
+}
+
+NEGATIVE_KEYWORDS = {
+    "unsubscribe": 2, "% off": 3, "sale": 2, "receipt": 3, "order #": 3, "your order": 3,
+    "shipping": 2, "shipped": 2, "invoice": 3, "newsletter": 3, "promo": 2, "coupon": 3,
+    "deal": 1, "subscription": 2, "password reset": 3, "verify your email": 2,
+    "payment": 2, "statement": 2, "webinar": 2, "limited time": 3,
+}
+
+_ADDRESS_RE = re.compile(r"[\w.+-]+@([\w-]+(?:\.[\w-]+)+)")
+
+
+def _keyword_patterns(keywords: dict) -> list:
+    # whole-word matches only, so "deal" does not fire on "ideal"
+    patterns = []
+    for keyword, weight in keywords.items():
+        start = r"(?<!\w)" if keyword[0].isalnum() else ""
+        end   = r"(?!\w)" if keyword[-1].isalnum() else ""
+        patterns.append((keyword, weight, re.compile(start + re.escape(keyword) + end)))
+    return patterns
+
+
+_POSITIVE = _keyword_patterns(POSITIVE_KEYWORDS)
+_NEGATIVE = _keyword_patterns(NEGATIVE_KEYWORDS)
+
+
+def _env_set(name: str) -> set:
+    return {d.strip().lower() for d in os.environ.get(name, "").split(",") if d.strip()}
+
+
+ALLOW_DOMAINS    = ATS_DOMAINS | _env_set("PREFILTER_ALLOW_DOMAINS")
+DENY_DOMAINS     = (DEFAULT_DENY_DOMAINS | _env_set("PREFILTER_DENY_DOMAINS")) - _env_set("PREFILTER_ALLOW_DOMAINS")
+REJECT_THRESHOLD = float(os.environ.get("PREFILTER_REJECT_THRESHOLD", "-3"))
+DENY_DOMAIN_WEIGHT = float(os.environ.get("PREFILTER_DENY_DOMAIN_WEIGHT", "4"))
+
+
+@dataclass
+class PrefilterResult:
+    decision: str                      # "llm" (send to Gemini) or "reject"
+    score: float
+    reasons: list = field(default_factory=list)
+
+
+def sender_domain(sender: str) -> str:
+    """Domain of the first address in a From header, lower-cased."""
+    match = _ADDRESS_RE.search(sender or "")
+    return match.group(1).lower() if match else ""
+
+
+def _domain_in(domain: str, domains: set) -> bool:
+    # match the domain itself or any parent (mail.greenhouse.io -> greenhouse.io)
+    parts = domain.split(".")
+    return any(".".join(parts[i:]) in domains for i in range(len(parts) - 1))
+
+
+def prefilter_email(email_content: str, sender: str = "", subject: str = "", headers: dict = None) -> PrefilterResult:
+    """Decide whether an email is worth a Gemini call."""
+    domain = sender_domain(sender)
+    header_text = " ".join(f"{k}: {v}" for k, v in (headers or {}).items()).lower()
+    mailer_text = " ".join([sender] + [f"{k}: {v}" for k, v in (headers or {}).items()
+                                       if k.lower() not in FREE_TEXT_HEADERS]).lower()
+    text = f"{subject}\n{email_content}".lower()
+
+    if domain and _domain_in(domain, ALLOW_DOMAINS):
+        return PrefilterResult("llm", float("inf"), [f"allow-domain:{domain}"])
+    for signature in ATS_SIGNATURES:
+        if signature in mailer_text:
+            return PrefilterResult("llm", float("inf"), [f"ats-signature:{signature}"])
+
+    score, reasons = 0.0, []
+    for board, weight in JOB_BOARD_DOMAINS.items():
+        if domain and _domain_in(domain, {board}):
+            score += weight
+            reasons.append(f"+job-board:{board}")
+    if domain and _domain_in(domain, DENY_DOMAINS):
+        score -= DENY_DOMAIN_WEIGHT
+        reasons.append(f"-deny-domain:{domain}")
+    for keyword, weight, pattern in _POSITIVE:
+        if pattern.search(text):
+            score += weight
+            reasons.append(f"+{keyword}")
+    for keyword, weight, pattern in _NEGATIVE:
+        if pattern.search(text):
+            score -= weight
+            reasons.append(f"-{keyword}")
+    if "list-unsubscribe" in header_text or "precedence: bulk" in header_text:
+        score -= 1
+        reasons.append("-bulk-headers")
+
+    decision = "reject" if score <= REJECT_THRESHOLD else "llm"
+    return PrefilterResult(decision, score, reasons)
+
+
+def evaluate(examples) -> dict:
+    """Precision/recall of "send to LLM" against labeled examples.
+
+    Each example is a dict with email_content, optional from/subject/headers,
+    and is_job (bool). Recall is what matters most: a job email rejected here
+    never reaches the classifier.
+    """
+    tp = fp = fn = tn = 0
+    for ex in examples:
+        result = prefilter_email(ex.get("email_content", ""), ex.get("from", ""),
+                                 ex.get("subject", ""), ex.get("headers"))
+        sent = result.decision == "llm"
+        if sent and ex["is_job"]:
+            tp += 1
+        elif sent:
+            fp += 1
+        elif ex["is_job"]:
+            fn += 1
+        else:
+            tn += 1
+
+    total = tp + fp + fn + tn
+    return {
+        "examples":          total,
+        "precision":         round(tp / (tp + fp), 3) if tp + fp else 0.0,
+        "recall":            round(tp / (tp + fn), 3) if tp + fn else 0.0,
+        "llm_calls":         tp + fp,
+        "llm_calls_saved":   fn + tn,
+        "llm_savings_pct":   round(100 * (fn + tn) / total, 1) if total else 0.0,
+        "job_emails_missed": fn,
+    }
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), "fixtures", "prefilter_labeled.jsonl")
+    with open(path) as f:
+        labeled = [json.loads(line) for line in f if line.strip()]
+    print(json.dumps(evaluate(labeled), indent=2))
@@ -0,0 +1,178 @@
+# backend/services/process_emails/pull_worker.py
+# Purpose: Alternative to the push endpoint that processes emails in micro-batches.
+
+# Functionality: Pulls up to PULL_MAX_MESSAGES from the subscription (or
+# whatever arrived within PULL_MAX_WAIT_SECS), classifies them (concurrently
+# one by one, or with classify_batch_fn the batch's cache misses in a few
+# multi-email Gemini requests; PULL_CLASSIFY_MODE=single|batch), writes all
+# job applications to Firestore and then BigQuery in one call each,
+# publishes a single batch-ready event and acks only the messages that made
+# it all the way through; the rest are nacked for redelivery. Dependencies
+# are injected so benchmark_pull.py can drive it with local fakes.
+#
+# Run with: python pull_worker.py  (e.g. as a Cloud Run job / worker pool)
+
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatchWorker:
+    def __init__(self, subscriber, subscription, classify_fn, build_records_fn,
+                 bq_write_fn, fs_write_fn, publish_fn, finish_fn=None, classify_batch_fn=None,
+                 max_messages=50, max_wait_secs=2.0, concurrency=16):
+        self.subscriber       = subscriber
+        self.subscription     = subscription
+        self.classify_fn      = classify_fn        # payload -> (details | None, reason)
+        self.build_records_fn = build_records_fn   # (payload, details) -> (bq_row, fs_doc)
+        self.bq_write_fn      = bq_write_fn        # rows -> insert errors [{"index": i, ...}]
+        self.fs_write_fn      = fs_write_fn        # [(user_id, email_id, doc)] -> failed email_ids
+        self.publish_fn       = publish_fn         # [email_id] -> None
+        self.finish_fn        = finish_fn          # (user_id, email_id, processed) -> None
+        self.classify_batch_fn = classify_batch_fn # [payload] -> [(details | None | Exception, reason)]
+        self.max_messages     = max_messages
+        self.max_wait_secs    = max_wait_secs
+        self.pool             = ThreadPoolExecutor(max_workers=concurrency)
+
+    def pull_batch(self):
+        """Collect messages until max_messages or max_wait_secs, whichever comes first."""
+        received = []
+        deadline = time.monotonic() + self.max_wait_secs
+        while len(received) < self.max_messages:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                response = self.subscriber.pull(
+                    request={"subscription": self.subscription,
+                             "max_messages": self.max_messages - len(received)},
+                    timeout=remaining,
+                )
+            except Exception as e:
+                # deadline exceeded with nothing new is the normal idle case
+                if received:
+                    break
+                print(f"[DEBUG] Pull returned no messages: {e}")
+                continue
+            received.extend(response.received_messages)
+        return received
+
+    def _ack(self, ack_ids):
+        if ack_ids:
+            self.subscriber.acknowledge(request={"subscription": self.subscription, "ack_ids": ack_ids})
+
+    def _nack(self, ack_ids):
+        if ack_ids:
+            self.subscriber.modify_ack_deadline(request={
+                "subscription": self.subscription, "ack_ids": ack_ids, "ack_deadline_seconds": 0,
+            })
+
+    def _classify(self, payload):
+        try:
+            return self.classify_fn(payload)
+        except Exception as e:
+            print(f"[ERROR] Classification failed for {payload.get('email_id')}: {e}")
+            return e, None
+
+    def process_batch(self, received):
+        """Classify, bulk-write and ack/nack one batch; returns (acked, nacked)."""
+        ack, nack, jobs = [], [], []
+        payloads = []
+        for rm in received:
+            try:
+                payload = json.loads(rm.message.data.decode("utf-8"))
+                if not payload.get("email_content") or not payload.get("user_id"):
+                    raise ValueError("missing email_content or user_id")
+                payload.setdefault("email_id", rm.message.message_id)
+                payloads.append((rm.ack_id, payload))
+            except Exception as e:
+                # malformed messages will never succeed; drop them
+                print(f"[ERROR] Dropping invalid message {rm.message.message_id}: {e}")
+                ack.append(rm.ack_id)
+
+        if self.classify_batch_fn and payloads:
+            try:
+                results = self.classify_batch_fn([payload for _, payload in payloads])
+            except Exception as e:
+                print(f"[ERROR] Batch classification of {len(payloads)} emails failed: {e}")
+                results = [(e, None)] * len(payloads)
+        else:
+            results = self.pool.map(lambda p: self._classify(p[1]), payloads)
+        for (ack_id, payload), (details, _) in zip(payloads, results):
+            if isinstance(details, Exception):
+                nack.append(ack_id)
+            elif details is None:
+                ack.append(ack_id)
+            else:
+                jobs.append((ack_id, payload, details))
+
+        if jobs:
+            try:
+                records    = [self.build_records_fn(payload, details) for _, payload, details in jobs]
+                # Firestore first: re-setting a doc on redelivery is harmless, re-appending
+                # a BigQuery row is not, so only rows whose doc is stored get appended
+                fs_failed  = self.fs_write_fn([
+                    (payload["user_id"], payload["email_id"], fs_doc)
+                    for (_, payload, _), (_, fs_doc) in zip(jobs, records)
+                ]) or set()
+                keep       = [i for i, (_, payload, _) in enumerate(jobs) if payload["email_id"] not in fs_failed]
+                bq_errors  = (self.bq_write_fn([records[i][0] for i in keep]) or []) if keep else []
+                bq_failed  = {keep[e["index"]] for e in bq_errors}
+            except Exception as e:
+                print(f"[ERROR] Writing batch of {len(jobs)} job emails failed: {e}")
+                bq_failed = set(range(len(jobs)))
+                fs_failed = set()
+
+            written = []
+            for i, (ack_id, payload, _) in enumerate(jobs):
+                ok = i not in bq_failed and payload["email_id"] not in fs_failed
+                if ok:
+                    ack.append(ack_id)
+                    written.append(payload["email_id"])
+                else:
+                    nack.append(ack_id)
+                if self.finish_fn:
+                    self.finish_fn(payload["user_id"], payload["email_id"], ok)
+            if written:
+                try:
+                    self.publish_fn(written)
+                except Exception as e:
+                    # rows are stored; only the dbt trigger notification was lost
+                    print(f"[ERROR] Failed to publish batch-ready event: {e}")
+
+        self._ack(ack)
+        self._nack(nack)
+        print(f"[DEBUG] Batch of {len(received)}: {len(jobs)} job emails, {len(ack)} acked, {len(nack)} nacked")
+        return len(ack), len(nack)
+
+    def run_forever(self):
+        print(f"[DEBUG] Pull worker listening on {self.subscription}")
+        while True:
+            received = self.pull_batch()
+            if received:
+                self.process_batch(received)
+
+
+if __name__ == "__main__":
+    from google.cloud import pubsub_v1
+    import main
+
+    subscriber = pubsub_v1.SubscriberClient()
+    subscription = subscriber.subscription_path(
+        main.PROJECT_ID, os.environ.get("PULL_SUBSCRIPTION", "new-emails-pull-sub"))
+
+    MicroBatchWorker(
+        subscriber,
+        subscription,
+        classify_fn=main.classify_payload,
+        classify_batch_fn=main.classify_payloads if os.environ.get("PULL_CLASSIFY_MODE", "batch") == "batch" else None,
+        build_records_fn=main.build_records,
+        bq_write_fn=main.save_results_to_bigquery,
+        fs_write_fn=main.save_many_to_firestore,
+        publish_fn=main.publish_batch_ready,
+        finish_fn=main.finish_email,
+        max_messages=int(os.environ.get("PULL_MAX_MESSAGES", "50")),
+        max_wait_secs=float(os.environ.get("PULL_MAX_WAIT_SECS", "2")),
+        concurrency=int(os.environ.get("PULL_CONCURRENCY", "16")),
+    ).run_forever()
@@ -0,0 +1,126 @@
+# backend/services/process_emails/raw_archive.py
+# Purpose: Keep raw email bodies out of the job_applications fact table.
+
+# Functionality: With RAW_CONTENT_MODE=archive, fact rows carry only a
+# content_hash and a short snippet. The body itself is compressed (zstd when
+# the zstandard package is installed, gzip otherwise) and written once per
+# hash to a separate archive table. Hashes this process has already archived
+# are remembered in an LRU, and archive inserts use insertId = content_hash,
+# so identical bodies (ATS templates, redeliveries) are stored once.
+
+import base64
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def content_hash(email_content: str) -> str:
+    return hashlib.sha256(email_content.encode("utf-8")).hexdigest()
+
+
+def compress(data: bytes):
+    """Returns (codec, compressed bytes)."""
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=10).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=9)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd archive rows")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "gzip":
+        return gzip.decompress(data)
+    raise ValueError(f"unknown codec {codec!r}")
+
+
+def load_archived_content(row) -> str:
+    """Original email text from an archive table row (compressed_content is base64 or bytes)."""
+    data = row["compressed_content"]
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    return decompress(row["codec"], data).decode("utf-8")
+
+
+class RawContentArchive:
+    """Writes each distinct body once through write_fn(rows) -> [{"index", "errors"}]."""
+
+    def __init__(self, write_fn, max_known=50_000):
+        self.write_fn   = write_fn
+        self.max_known  = max_known
+        self._known     = OrderedDict()
+        self._lock      = threading.Lock()
+        self._stats = {"bodies": 0, "deduplicated": 0, "archived": 0,
+                       "original_bytes": 0, "compressed_bytes": 0}
+
+    def _is_known(self, key):
+        with self._lock:
+            if key in self._known:
+                self._known.move_to_end(key)
+                return True
+            return False
+
+    def _remember(self, keys):
+        with self._lock:
+            for key in keys:
+                self._known[key] = True
+                self._known.move_to_end(key)
+            while len(self._known) > self.max_known:
+                self._known.popitem(last=False)
+
+    def store(self, items):
+        """Archive [(content_hash, email_content)]; returns {item_index: errors} for failures."""
+        rows, owners, seen = [], [], {}
+        original = compressed = 0
+        for i, (key, content) in enumerate(items):
+            if self._is_known(key):
+                continue
+            if key in seen:
+                owners[seen[key]].append(i)
+                continue
+            raw = content.encode("utf-8")
+            codec, blob = compress(raw)
+            original += len(raw)
+            compressed += len(blob)
+            seen[key] = len(rows)
+            owners.append([i])
+            rows.append({
+                "content_hash":       key,
+                "codec":              codec,
+                "compressed_content": base64.b64encode(blob).decode("ascii"),
+                "original_bytes":     len(raw),
+                "compressed_bytes":   len(blob),
+                "archived_at":        datetime.utcnow().isoformat(),
+            })
+
+        errors = {}
+        if rows:
+            for err in self.write_fn(rows) or []:
+                for i in owners[err["index"]]:
+                    errors[i] = err["errors"]
+        failed = {rows[seen[items[i][0]]]["content_hash"] for i in errors}
+        self._remember(row["content_hash"] for row in rows if row["content_hash"] not in failed)
+
+        with self._lock:
+            self._stats["bodies"]           += len(items)
+            self._stats["deduplicated"]     += len(items) - len(rows)
+            self._stats["archived"]         += len(rows) - len(failed)
+            self._stats["original_bytes"]   += original
+            self._stats["compressed_bytes"] += compressed
+        return errors
+
+    def metrics(self):
+        with self._lock:
+            s = dict(self._stats)
+        s["compression_ratio"] = (round(s["original_bytes"] / s["compressed_bytes"], 2)
+                                  if s["compressed_bytes"] else 0.0)
+        s["codec"] = "zstd" if zstandard is not None else "gzip"
+        return s
@@ -0,0 +1,118 @@
+# backend/services/process_emails/write_buffer.py
+# Purpose: Shared group-commit buffer for the BigQuery and Firestore writers.
+
+# Functionality: Request threads submit items and get a Future back; items
+# from all threads are written together when max_items accumulate or the
+# oldest item is max_age_secs old. Each Future resolves to the errors for the
+# caller's own items ({local_index: error}), so a caller can wait on it and
+# only ack its Pub/Sub message once its data is durable.
+
+import threading
+import time
+from concurrent.futures import Future
+
+
+class GroupCommitBuffer:
+    """Subclasses implement _write(items) -> {index: error} for a flat item list."""
+
+    name = "writer"
+
+    def __init__(self, max_items, max_age_secs):
+        self.max_items     = max_items
+        self.max_age_secs  = max_age_secs
+        self._pending      = []       # [(items, future)]
+        self._pending_count = 0
+        self._oldest       = None
+        self._lock         = threading.Condition()
+        self._flush_lock   = threading.Lock()
+        self._closed       = False
+        self._stats = {"flushes": 0, "items_flushed": 0, "flush_seconds": 0.0, "max_flush_ms": 0.0}
+        self._thread = threading.Thread(target=self._age_loop, name=f"{self.name}-flusher", daemon=True)
+        self._thread.start()
+
+    def _write(self, items):
+        raise NotImplementedError
+
+    def submit(self, items):
+        """Queue items for the next flush; returns a Future of {local_index: error}."""
+        future = Future()
+        if not items:
+            future.set_result({})
+            return future
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} is closed")
+            self._pending.append((items, future))
+            self._pending_count += len(items)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = self._pending_count >= self.max_items
+            self._lock.notify()
+        if full:
+            self.flush()
+        return future
+
+    def _age_loop(self):
+        while True:
+            with self._lock:
+                while not self._closed and self._oldest is None:
+                    self._lock.wait()
+                if self._closed:
+                    return
+                wait = self._oldest + self.max_age_secs - time.monotonic()
+                if wait > 0:
+                    self._lock.wait(wait)
+                    continue
+            self.flush()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._pending_count, self._oldest = 0, None
+            if not batch:
+                return
+
+            items = [item for chunk, _ in batch for item in chunk]
+            started = time.perf_counter()
+            try:
+                errors = self._write(items) or {}
+            except Exception as e:
+                print(f"[ERROR] {self.name} flush of {len(items)} items failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            elapsed = time.perf_counter() - started
+
+            self._stats["flushes"]       += 1
+            self._stats["items_flushed"] += len(items)
+            self._stats["flush_seconds"] += elapsed
+            self._stats["max_flush_ms"]   = max(self._stats["max_flush_ms"], elapsed * 1000)
+            print(f"[DEBUG] {self.name} flushed {len(items)} items in {elapsed * 1000:.1f} ms")
+
+            # hand each caller the errors for its own items, re-indexed
+            start = 0
+            for chunk, future in batch:
+                future.set_result({i - start: errors[i]
+                                   for i in range(start, start + len(chunk)) if i in errors})
+                start += len(chunk)
+
+    def drain(self):
+        """Flush everything still buffered and stop the age thread (shutdown hook)."""
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self.flush()
+        print(f"[DEBUG] {self.name} drained")
+
+    def metrics(self):
+        with self._lock:
+            depth = self._pending_count
+        flushes = self._stats["flushes"] or 1
+        return {
+            "buffer_depth":  depth,
+            "flushes":       self._stats["flushes"],
+            "items_flushed": self._stats["items_flushed"],
+            "avg_flush_ms":  round(self._stats["flush_seconds"] * 1000 / flushes, 1),
+            "max_flush_ms":  round(self._stats["max_flush_ms"], 1),
+        }